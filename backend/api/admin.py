@@ -1,10 +1,12 @@
+from collections import Counter
+
 from django import forms
 from django.contrib import admin
 from django.contrib.admin.widgets import FilteredSelectMultiple
 from django.contrib.auth.admin import UserAdmin
 
 from recipes.models import (FavoriteRecipe, Ingredient, IngredientAmount,
-                            Recipe, ShoppingCart, Tag)
+                            Recipe, ShoppingCart, ShoppingListItem, Tag)
 from users.models import User
 
 
@@ -42,13 +44,28 @@ class RecipeAdmin(admin.ModelAdmin):
     readonly_fields = ('get_favorite_count',)
     form = RecipeForm
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Recipe.objects.filter(pk=form.instance.pk).refresh_tags_mask()
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not IngredientAmount:
+            return super().save_formset(request, form, formset, change)
+        amounts = IngredientAmount.objects.filter(
+            recipe=form.instance
+        ).values_list('ingredient_id', 'amount')
+        deltas = Counter()
+        deltas.subtract(dict(amounts))
+        super().save_formset(request, form, formset, change)
+        deltas.update(dict(amounts.all()))
+        ShoppingListItem.objects.change_recipe(form.instance.pk, deltas)
+
     def display_tags(self, obj):
         return ", ".join(tag['name'] for tag in obj.tags.values('name'))
     display_tags.short_description = 'Теги'
 
     def get_favorite_count(self, obj):
-        favorite = FavoriteRecipe.objects.filter(recipe=obj)
-        return favorite.count()
+        return obj.favorites_count
     get_favorite_count.short_description = 'Число добавлений в избранное'
 
 
@@ -0,0 +1,58 @@
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from api.db import check_connections
+from api.views import IngredientsViewSet, RecipeViewSet, TagViewSet
+from users.views import CustomUserViewSet
+
+
+def offload(view):
+    '''Асинхронная обёртка над синхронным представлением DRF.
+
+    В Django 3.2 нет асинхронного ORM, а синхронные представления под ASGI
+    выполняются по очереди в одном потоке. Здесь запрос целиком, вместе
+    с рендерингом ответа, уходит в общий пул потоков, и медленный клиент
+    или ожидание базы не блокируют остальные запросы. Соединение с базой
+    проверяется и закрывается по тем же правилам CONN_MAX_AGE, что и
+    в обычном запросе: у каждого потока пула своё соединение.
+    '''
+
+    def run(request, *args, **kwargs):
+        close_old_connections()
+        check_connections()
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+        finally:
+            close_old_connections()
+
+    run_in_thread = sync_to_async(run, thread_sensitive=False)
+
+    async def async_view(request, *args, **kwargs):
+        return await run_in_thread(request, *args, **kwargs)
+
+    async_view.csrf_exempt = True
+    async_view.cls = view.cls
+    return async_view
+
+
+def viewset_view(viewset, action, basename, detail):
+    '''Представление одного действия вьюсета с теми же параметрами, что
+    выставляет роутер.'''
+    initkwargs = {'basename': basename, 'detail': detail}
+    initkwargs.update(getattr(getattr(viewset, action), 'kwargs', {}))
+    return offload(viewset.as_view({'get': action}, **initkwargs))
+
+
+recipe_list = viewset_view(RecipeViewSet, 'list', 'recipes', False)
+recipe_detail = viewset_view(RecipeViewSet, 'retrieve', 'recipes', True)
+tag_list = viewset_view(TagViewSet, 'list', 'tags', False)
+tag_detail = viewset_view(TagViewSet, 'retrieve', 'tags', True)
+ingredient_list = viewset_view(
+    IngredientsViewSet, 'list', 'ingredients', False)
+ingredient_detail = viewset_view(
+    IngredientsViewSet, 'retrieve', 'ingredients', True)
+subscriptions = viewset_view(
+    CustomUserViewSet, 'subscriptions', 'users', False)
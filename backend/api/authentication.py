@@ -0,0 +1,73 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from users.models import User
+
+# Не кэшируются: счётчики меняются F()-обновлениями без сигналов, а хэшу
+# пароля нечего делать в кэше.
+CACHED_USER_DEFERRED = ('password',) + User.counter_fields
+
+
+def token_cache_key(key):
+    '''Сам токен в ключ кэша не попадает.'''
+    return f'auth:token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def invalidate_tokens(keys):
+    cache.delete_many([token_cache_key(key) for key in keys])
+
+
+def invalidate_user(user_id):
+    '''Удаляет пользователя из кэша сразу и ещё раз после коммита: иначе
+    параллельный запрос мог бы закэшировать строку, прочитанную до
+    коммита.'''
+    key = user_cache_key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''TokenAuthentication с кэшем токен -> id пользователя и
+    id -> пользователь.
+
+    Аутентификация по закэшированному токену обходится без запросов
+    к базе. Строка пользователя удаляется из кэша при save() и delete()
+    пользователя, токен при его удалении (logout). Изменения через
+    QuerySet.update() станут видны не позже TOKEN_CACHE_TIMEOUT. Поля
+    CACHED_USER_DEFERRED отложены и читаются из базы при обращении. Кэш
+    включается только с общим для воркеров бэкендом (CACHE_SHARED), иначе
+    удаление токена при logout увидел бы лишь один воркер.
+    '''
+
+    def authenticate_credentials(self, key):
+        if not settings.CACHE_SHARED or not settings.TOKEN_CACHE_TIMEOUT:
+            return super().authenticate_credentials(key)
+        cache_key = token_cache_key(key)
+        user_id = cache.get(cache_key)
+        user = None if user_id is None else cache.get(user_cache_key(user_id))
+        if user is None:
+            token = self.get_model().objects.select_related('user').defer(
+                *(f'user__{field}' for field in CACHED_USER_DEFERRED),
+            ).filter(key=key).first()
+            if token is None:
+                raise AuthenticationFailed(_('Invalid token.'))
+            user = token.user
+            cache.set_many({
+                cache_key: user.pk,
+                user_cache_key(user.pk): user,
+            }, settings.TOKEN_CACHE_TIMEOUT)
+        if not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        token = self.get_model()(key=key, user=user)
+        token._state.adding = False
+        return user, token
@@ -0,0 +1,157 @@
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from api.serializers import TagSerializer
+from foodgram_backend.metrics import registry
+from recipes.models import Ingredient, Tag
+
+STATS_FLUSH_EVERY = 100
+STATS_FLUSH_SECONDS = 10
+
+
+class ReferenceCache:
+    '''Кэш справочника целиком со счётчиками попаданий и промахов.
+
+    Версия справочника хранится отдельным ключом, строки - вместе с
+    версией, под которой их начали собирать. invalidate() меняет версию, и
+    строки, собранные до неё, больше не отдаются, даже если сборка
+    закончилась после инвалидации. По версии потребители вроде индекса
+    ингредиентов понимают, что справочник изменился, не загружая его.
+
+    Счётчики копятся в памяти процесса и сбрасываются в кэш пачками по
+    STATS_FLUSH_EVERY событий, но не реже раза в STATS_FLUSH_SECONDS.
+    Суммы по кэшу видит команда cache_stats, и только при общем для
+    процессов бэкенде: у LocMemCache свой кэш в каждом процессе. Счётчики
+    самого процесса отдаются на /metrics/.
+    '''
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+        self.key = f'reference:{name}'
+        self.version_key = f'{self.key}:version'
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._flushed_at = time.monotonic()
+        self.totals = Counter()
+
+    def get(self):
+        '''Возвращает пару (версия, строки справочника).'''
+        cached = cache.get_many([self.version_key, self.key])
+        version = cached.get(self.version_key)
+        entry = cached.get(self.key)
+        if version is not None and entry is not None and entry[0] == version:
+            self._count('hits')
+            return entry
+        self._count('misses')
+        if version is None:
+            version = self._create_version()
+        entry = (version, self.build())
+        cache.set(self.key, entry, settings.REFERENCE_CACHE_TIMEOUT)
+        return entry
+
+    def rows(self):
+        return self.get()[1]
+
+    def version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            version = self._create_version()
+        return version
+
+    def invalidate(self):
+        '''Меняет версию сразу и ещё раз после коммита: строки, собранные
+        другим запросом до коммита изменения, остаются под старой
+        версией.'''
+        self._bump_version()
+        transaction.on_commit(self._bump_version)
+
+    def stats(self):
+        self._flush_stats()
+        counters = cache.get_many(
+            [f'{self.key}:hits', f'{self.key}:misses'])
+        return {
+            'hits': counters.get(f'{self.key}:hits', 0),
+            'misses': counters.get(f'{self.key}:misses', 0),
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self._pending.clear()
+            self._flushed_at = time.monotonic()
+        cache.delete_many([f'{self.key}:hits', f'{self.key}:misses'])
+
+    def _create_version(self):
+        version = uuid.uuid4().hex
+        if cache.add(
+            self.version_key, version, settings.REFERENCE_CACHE_TIMEOUT
+        ):
+            return version
+        return cache.get(self.version_key, version)
+
+    def _bump_version(self):
+        cache.set(
+            self.version_key,
+            uuid.uuid4().hex,
+            settings.REFERENCE_CACHE_TIMEOUT,
+        )
+
+    def _count(self, kind):
+        with self._lock:
+            self.totals[kind] += 1
+            self._pending[kind] += 1
+            if (sum(self._pending.values()) < STATS_FLUSH_EVERY
+                    and time.monotonic() - self._flushed_at
+                    < STATS_FLUSH_SECONDS):
+                return
+        self._flush_stats()
+
+    def _flush_stats(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._flushed_at = time.monotonic()
+        for kind, count in pending.items():
+            key = f'{self.key}:{kind}'
+            if not cache.add(key, count, timeout=None):
+                try:
+                    cache.incr(key, count)
+                except ValueError:
+                    cache.set(key, count, timeout=None)
+
+
+def build_tags():
+    return [
+        dict(tag)
+        for tag in TagSerializer(Tag.objects.order_by('id'), many=True).data
+    ]
+
+
+def build_ingredients():
+    return list(Ingredient.objects.order_by('id').values(
+        'id', 'name', 'measurement_unit'))
+
+
+tag_cache = ReferenceCache('tags', build_tags)
+ingredient_cache = ReferenceCache('ingredients', build_ingredients)
+
+REFERENCE_CACHES = (tag_cache, ingredient_cache)
+
+
+@registry.register
+def reference_cache_metrics():
+    lines = []
+    for kind in ('hits', 'misses'):
+        name = f'foodgram_reference_cache_{kind}_total'
+        lines.append(f'# HELP {name} Обращения к кэшу справочника ({kind})')
+        lines.append(f'# TYPE {name} counter')
+        for reference_cache in REFERENCE_CACHES:
+            lines.append(
+                f'{name}{{cache="{reference_cache.name}"}} '
+                f'{reference_cache.totals[kind]}')
+    return lines
@@ -0,0 +1,17 @@
+from django.db import connections
+
+
+def check_connections():
+    '''Закрывает переиспользуемые соединения, которые перестали отвечать.
+
+    В Django 3.2 нет CONN_HEALTH_CHECKS: при CONN_MAX_AGE > 0 запрос
+    после перезапуска PostgreSQL или pgbouncer падал бы на мёртвом
+    соединении. Проверяются только уже открытые соединения, новое
+    откроется при первом запросе к базе.
+    '''
+    for connection in connections.all():
+        if (connection.connection is None
+                or not connection.settings_dict.get('CONN_HEALTH_CHECKS')):
+            continue
+        if not connection.is_usable():
+            connection.close()
@@ -0,0 +1,21 @@
+import logging
+
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import exception_handler as drf_exception_handler
+
+from recipes.models import ShoppingListOutOfSync
+
+logger = logging.getLogger(__name__)
+
+
+def exception_handler(exc, context):
+    '''Обработчик DRF, который вместо 500 отвечает 409 на расхождение
+    списков покупок с корзинами.'''
+    if isinstance(exc, ShoppingListOutOfSync):
+        logger.error('%s Запрос: %s', exc, context['request'].path)
+        return Response(
+            {'errors': str(exc)},
+            status=status.HTTP_409_CONFLICT,
+        )
+    return drf_exception_handler(exc, context)
@@ -0,0 +1,107 @@
+import statistics
+
+from django.core.management import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.management.endpoints import get_cases
+from api.management.seed import seeded_test_database
+
+
+class Command(BaseCommand):
+    help = ('Заполняет тестовую базу и выводит число SQL-запросов и время '
+            'ответа эндпоинтов API. Завершается с ошибкой, если бюджет '
+            'запросов превышен или ответ пришёл с неожиданным кодом, а с '
+            '--check-latency и если медиана времени больше baseline * '
+            '--tolerance')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Число замеров на эндпоинт',
+        )
+        parser.add_argument(
+            '--check-latency',
+            action='store_true',
+            help=('Проверять медиану времени. Baseline сняты на данных по '
+                  'умолчанию, на другой машине их стоит пересмотреть'),
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=1.5,
+            help='Допустимое превышение baseline по медиане времени',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=50,
+            help='Число пользователей в тестовых данных',
+        )
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=10,
+            help='Число рецептов у каждого пользователя',
+        )
+
+    def handle(self, *args, **options):
+        with seeded_test_database(
+            users=options['users'],
+            recipes_per_user=options['recipes'],
+        ) as reader:
+            client = APIClient()
+            client.credentials(
+                HTTP_AUTHORIZATION=(
+                    f'Token {Token.objects.get(user=reader).key}'))
+            failures = self.run(
+                get_cases(reader, client, options['repeat']),
+                client,
+                options,
+            )
+        if failures:
+            raise CommandError('\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Все бюджеты соблюдены'))
+
+    def run(self, groups, client, options):
+        repeat = options['repeat']
+        anonymous = APIClient()
+        failures = []
+
+        self.stdout.write(
+            f'{"эндпоинт":<56}{"запросы":>10}{"медиана":>10}{"p95":>10}'
+            f'{"baseline":>10}')
+        for group in groups:
+            for iteration in range(-1, repeat):
+                for case in group:
+                    elapsed, queries = case.run(
+                        anonymous if case.anonymous else client,
+                        max(iteration, 0),
+                    )
+                    if iteration >= 0:
+                        case.timings.append(elapsed)
+                        case.query_counts.append(queries)
+            for case in group:
+                failures.extend(self.report(case, options))
+        return failures
+
+    def report(self, case, options):
+        name = case.label
+        queries = max(case.query_counts)
+        median = statistics.median(case.timings)
+        p95 = sorted(case.timings)[int(len(case.timings) * 0.95) - 1]
+        self.stdout.write(
+            f'{name:<56}{f"{queries}/{case.queries}":>10}'
+            f'{median:>9.1f}ms{p95:>8.1f}ms{case.baseline:>8}ms')
+
+        failures = [f'{name}: {error}' for error in case.errors[:3]]
+        if queries > case.queries:
+            failures.append(
+                f'{name}: {queries} SQL-запросов при бюджете {case.queries}')
+        limit = case.baseline * options['tolerance']
+        if options['check_latency'] and median > limit:
+            failures.append(
+                f'{name}: медиана {median:.1f} мс больше {limit:.1f} мс')
+        return failures
@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand
+
+from recipes.images import build_derivatives, derivatives_outdated
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии и WebP-версии фото рецептов'
+
+    def handle(self, *args, **options):
+        # id выбираются заранее: пока открыт курсор выборки, SQLite
+        # блокирует запись, а серверный курсор PostgreSQL живёт только
+        # в своей транзакции.
+        recipe_ids = [
+            recipe.pk
+            for recipe in Recipe.objects.only(
+                'id', 'image', 'image_thumbnail', 'image_webp')
+            if derivatives_outdated(recipe)
+        ]
+        built = sum(
+            build_derivatives(recipe_id) for recipe_id in recipe_ids)
+        self.stdout.write(
+            f'Обработано фото: {built}, ошибок: {len(recipe_ids) - built}')
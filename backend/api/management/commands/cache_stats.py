@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from api.cache import REFERENCE_CACHES
+
+
+class Command(BaseCommand):
+    help = ('Показывает счётчики попаданий в кэш справочников, '
+            'накопленные всеми процессами. Работает только с общим '
+            'бэкендом кэша (CACHE_SHARED): при LocMemCache у каждого '
+            'процесса свой кэш, и команда покажет нули. Счётчики одного '
+            'процесса видны на /metrics/')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Обнулить счётчики после вывода',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.CACHE_SHARED:
+            self.stderr.write(self.style.WARNING(
+                'Кэш не общий: счётчики веб-процессов здесь не видны, '
+                'смотрите /metrics/'))
+        for reference_cache in REFERENCE_CACHES:
+            stats = reference_cache.stats()
+            self.stdout.write(
+                f'{reference_cache.name}: '
+                f'hits={stats["hits"]} misses={stats["misses"]}'
+            )
+            if options['reset']:
+                reference_cache.reset_stats()
@@ -0,0 +1,193 @@
+import json
+from contextlib import ExitStack
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.management.seed import seeded_test_database
+from recipes.models import Recipe, Tag
+
+
+def walk(node):
+    yield node
+    for child in node.get('Plans', ()):
+        yield from walk(child)
+
+
+def plan_problems(plan, min_rows, ignore):
+    '''Узлы плана EXPLAIN (ANALYZE, FORMAT JSON), которые не должны
+    появляться на данных продакшен-размера.'''
+    problems = []
+    for node in walk(plan):
+        loops = node.get('Actual Loops', 1)
+        if node['Node Type'] == 'Seq Scan':
+            relation = node['Relation Name']
+            rows = (node.get('Actual Rows', 0)
+                    + node.get('Rows Removed by Filter', 0)) * loops
+            if relation in ignore or rows < min_rows:
+                continue
+            if 'Filter' in node:
+                problems.append(
+                    f'Seq Scan {relation} ({rows} строк): нет индекса '
+                    f'для условия {node["Filter"]}')
+            else:
+                problems.append(f'Seq Scan {relation} ({rows} строк)')
+        elif node['Node Type'] in ('Sort', 'Incremental Sort'):
+            keys = ', '.join(node.get('Sort Key', ()))
+            if node.get('Sort Space Type') == 'Disk':
+                problems.append(
+                    f'Сортировка по {keys} на диске: '
+                    f'{node.get("Sort Space Used")} kB')
+                continue
+            rows = sum(
+                child.get('Actual Rows', 0) * child.get('Actual Loops', 1)
+                for child in node.get('Plans', ())
+            )
+            if rows >= min_rows:
+                problems.append(
+                    f'Сортировка {rows} строк по {keys}: нет индекса '
+                    f'для порядка')
+    return problems
+
+
+class Command(BaseCommand):
+    help = ('Заполняет тестовую базу PostgreSQL, выполняет запросы '
+            'эндпоинтов API и проверяет их планы EXPLAIN ANALYZE. '
+            'Завершается с ошибкой при последовательном чтении больших '
+            'таблиц, сортировке без индекса или на диске')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=200,
+            help='Число пользователей в тестовых данных',
+        )
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=50,
+            help='Число рецептов у каждого пользователя',
+        )
+        parser.add_argument(
+            '--min-rows',
+            type=int,
+            default=1000,
+            help='С какого числа прочитанных или отсортированных строк '
+                 'узел плана считается проблемой',
+        )
+        parser.add_argument(
+            '--ignore',
+            action='append',
+            default=[],
+            help='Таблица, последовательное чтение которой допустимо',
+        )
+        parser.add_argument(
+            '--verbose-plans',
+            action='store_true',
+            help='Выводить планы запросов с проблемами целиком',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError(
+                'Планы запросов проверяются только на PostgreSQL, '
+                f'текущая база: {connection.vendor}')
+        with seeded_test_database(
+            users=options['users'],
+            recipes_per_user=options['recipes'],
+        ) as reader:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            failures = self.run(reader, options)
+        if failures:
+            raise CommandError(
+                f'Проблемных запросов: {len(failures)}\n'
+                + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Планы запросов в порядке'))
+
+    def get_endpoints(self, reader):
+        '''Читающие эндпоинты с фильтрами и сортировками. Второй элемент
+        показывает, нужен ли токен.'''
+        recipe = Recipe.objects.exclude(author=reader).values_list(
+            'id', flat=True).first()
+        tags = Tag.objects.order_by('id').values_list('slug', flat=True)
+        return [
+            ('/api/tags/', False),
+            ('/api/ingredients/?name=Ингредиент 1', False),
+            ('/api/recipes/', False),
+            ('/api/recipes/', True),
+            ('/api/recipes/?paginate=cursor', True),
+            (f'/api/recipes/?tags={tags[0]}', True),
+            (f'/api/recipes/?tags={tags[0]}&tags={tags[1]}', True),
+            (f'/api/recipes/?author={reader.pk}', True),
+            ('/api/recipes/?is_favorited=1', True),
+            ('/api/recipes/?is_in_shopping_cart=1', True),
+            ('/api/recipes/?search=запечь', True),
+            (f'/api/recipes/{recipe}/', False),
+            (f'/api/recipes/{recipe}/', True),
+            ('/api/recipes/download_shopping_cart/', True),
+            ('/api/recipes/favorites/', True),
+            ('/api/users/', True),
+            (f'/api/users/{reader.pk}/', True),
+            ('/api/users/me/', True),
+            ('/api/users/subscriptions/', True),
+            ('/api/users/feed/', True),
+        ]
+
+    def run(self, reader, options):
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.get(user=reader).key}')
+        failures = []
+        for url, authenticated in self.get_endpoints(reader):
+            queries = self.capture(
+                client if authenticated else APIClient(), url)
+            label = f'GET {url}' + (' (токен)' if authenticated else '')
+            self.stdout.write(f'{label}: {len(queries)} SELECT')
+            for alias, sql in queries:
+                plan = self.explain(alias, sql)
+                problems = plan_problems(
+                    plan['Plan'], options['min_rows'], set(options['ignore']))
+                if not problems:
+                    continue
+                self.stdout.write(f'  {sql}')
+                for problem in problems:
+                    self.stdout.write(self.style.ERROR(f'    {problem}'))
+                if options['verbose_plans']:
+                    self.stdout.write(json.dumps(plan, indent=2))
+                failures.append(f'{label}: {"; ".join(problems)}')
+        return failures
+
+    def capture(self, client, url):
+        '''Уникальные SELECT-запросы эндпоинта по всем базам.'''
+        with ExitStack() as stack:
+            contexts = {
+                alias: stack.enter_context(
+                    CaptureQueriesContext(connections[alias]))
+                for alias in connections
+            }
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        if response.status_code != 200:
+            raise CommandError(f'GET {url}: {response.status_code}')
+        queries = []
+        for alias, context in contexts.items():
+            for query in context.captured_queries:
+                sql = query['sql']
+                if (sql.lstrip().upper().startswith(('SELECT', 'WITH'))
+                        and (alias, sql) not in queries):
+                    queries.append((alias, sql))
+        return queries
+
+    def explain(self, alias, sql):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}')
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]
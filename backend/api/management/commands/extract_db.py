@@ -1,49 +1,130 @@
 import csv
+import json
 import os
-import traceback
+import tempfile
+import time
+from itertools import islice
 
 from django.conf import settings
 from django.core.management import BaseCommand
+from django.db import connection, transaction
 
+from api.cache import ingredient_cache
 from recipes.models import Ingredient
 
-ERROR_MESSAGE = """
-Если в БД существуют данные, требуется удалить бд и заново провести
-миграции для создания пустой бд.
+CSV_FIELDS = {'name': 'ингредиент', 'measurement_unit': 'мера'}
+
+CREATE_IMPORT_TABLE_SQL = """
+CREATE TEMPORARY TABLE ingredient_import (
+    name varchar(255),
+    measurement_unit varchar(10)
+) ON COMMIT DROP
+"""
+COPY_SQL = (
+    'COPY ingredient_import (name, measurement_unit) '
+    'FROM STDIN WITH (FORMAT csv)'
+)
+INSERT_SQL = """
+INSERT INTO {table} (name, measurement_unit)
+SELECT DISTINCT name, measurement_unit FROM ingredient_import
+ON CONFLICT (name, measurement_unit) DO NOTHING
 """
 
 
 class Command(BaseCommand):
+    help = ('Загружает ингредиенты из data/ingredients.csv и '
+            'data/ingredients.json, добавляя только отсутствующие')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Размер пачки для bulk_create',
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Не использовать COPY даже на PostgreSQL',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        before = Ingredient.objects.count()
+        rows = self.read_rows()
+
+        with transaction.atomic():
+            if connection.vendor == 'postgresql' and not options['no_copy']:
+                total = self.load_with_copy(rows)
+            else:
+                total = self.load_in_batches(rows, options['batch_size'])
+        ingredient_cache.invalidate()
+
+        elapsed = time.monotonic() - started
+        created = Ingredient.objects.count() - before
+        self.stdout.write(
+            f'Импорт завершён: прочитано {total}, добавлено {created}, '
+            f'{total / elapsed if elapsed else total:.0f} строк/с'
+        )
+
+    def read_rows(self):
+        '''Уникальные пары (название, единица) из обоих файлов.'''
+        seen = set()
+        for row in self.read_csv('ingredients.csv'):
+            if row not in seen:
+                seen.add(row)
+                yield row
+        for row in self.read_json('ingredients.json'):
+            if row not in seen:
+                seen.add(row)
+                yield row
+
+    def read_csv(self, filename):
+        with open(
+            os.path.join(settings.BASE_DIR, 'data', filename),
+            encoding='utf-8'
+        ) as file:
+            for row in csv.DictReader(file):
+                yield (
+                    row[CSV_FIELDS['name']].strip(),
+                    row[CSV_FIELDS['measurement_unit']].strip(),
+                )
+
+    def read_json(self, filename):
+        with open(
+            os.path.join(settings.BASE_DIR, 'data', filename),
+            encoding='utf-8'
+        ) as file:
+            for row in json.load(file):
+                yield row['name'].strip(), row['measurement_unit'].strip()
+
+    def load_in_batches(self, rows, batch_size):
+        total = 0
+        while True:
+            batch = [
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in islice(rows, batch_size)
+            ]
+            if not batch:
+                return total
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+            total += len(batch)
 
-    def handle(self, *args, **options,):
-        if Ingredient.objects.exists():
-            print(ERROR_MESSAGE)
-            return
-
-        try:
-            self.load_data_from_csv(
-                'ingredients.csv',
-                Ingredient,
-                name='ингредиент',
-                measurement_unit='мера'
-            )
-            print('Импорт завершён')
-        except Exception:
-            traceback.print_exc()
-
-    def load_data_from_csv(self, filename, model_class, **field_names):
-        try:
-            with open(
-                os.path.join(settings.BASE_DIR, 'data', filename),
-                encoding='utf-8'
-            ) as file:
-                for row in csv.DictReader(file):
-                    kwargs = {}
-                    for field_name, csv_column_name in field_names.items():
-                        kwargs[field_name] = row[csv_column_name]
-                    model_instance = model_class(**kwargs)
-                    model_instance.save()
-        except ValueError:
-            print('Значение неопределенно')
-        except Exception:
-            raise
+    def load_with_copy(self, rows):
+        total = 0
+        with tempfile.SpooledTemporaryFile(
+            mode='w+', encoding='utf-8'
+        ) as file:
+            writer = csv.writer(file)
+            for row in rows:
+                writer.writerow(row)
+                total += 1
+            file.seek(0)
+            with connection.cursor() as cursor:
+                cursor.execute(CREATE_IMPORT_TABLE_SQL)
+                cursor.copy_expert(COPY_SQL, file)
+                cursor.execute(INSERT_SQL.format(
+                    table=connection.ops.quote_name(
+                        Ingredient._meta.db_table)
+                ))
+        return total
@@ -0,0 +1,88 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ('Нагружает запущенный сервер параллельными GET-запросами и '
+            'выводит пропускную способность и задержки')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'urls',
+            nargs='+',
+            help='Адреса, запрашиваемые по кругу',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=50,
+            help='Число одновременных соединений',
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=10,
+            help='Длительность замера в секундах',
+        )
+        parser.add_argument(
+            '--token',
+            help='Токен для заголовка Authorization',
+        )
+
+    def handle(self, *args, **options):
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        urls = options['urls']
+        deadline = time.monotonic() + options['duration']
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker(offset):
+            session = requests.Session()
+            session.headers.update(headers)
+            own_latencies = []
+            own_errors = []
+            index = offset
+            while time.monotonic() < deadline:
+                url = urls[index % len(urls)]
+                index += 1
+                started = time.perf_counter()
+                try:
+                    response = session.get(url, timeout=30)
+                except requests.RequestException as error:
+                    own_errors.append(type(error).__name__)
+                    continue
+                own_latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    own_errors.append(str(response.status_code))
+            with lock:
+                latencies.extend(own_latencies)
+                errors.extend(own_errors)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(worker, range(options['concurrency'])))
+        elapsed = time.monotonic() - started
+
+        if not latencies:
+            raise CommandError(f'Нет успешных ответов, ошибки: {errors[:5]}')
+        latencies.sort()
+
+        def percentile(value):
+            return latencies[int(len(latencies) * value) - 1] * 1000
+
+        self.stdout.write(
+            f'соединений: {options["concurrency"]}, '
+            f'ответов: {len(latencies)}, ошибок: {len(errors)}\n'
+            f'запросов в секунду: {len(latencies) / elapsed:.1f}\n'
+            f'задержка, мс: медиана '
+            f'{statistics.median(latencies) * 1000:.1f}, '
+            f'p95 {percentile(0.95):.1f}, p99 {percentile(0.99):.1f}'
+        )
@@ -0,0 +1,55 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает или проверяет агрегированные списки покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сравнить сохранённые суммы с пересчитанными',
+        )
+
+    def handle(self, *args, **options):
+        expected = ShoppingListItem.objects.expected()
+
+        if options['verify']:
+            stored = {
+                (user_id, ingredient_id): amount
+                for user_id, ingredient_id, amount
+                in ShoppingListItem.objects.values_list(
+                    'user_id', 'ingredient_id', 'amount')
+            }
+            drift = {
+                key for key in expected.keys() | stored.keys()
+                if expected.get(key) != stored.get(key)
+            }
+            for user_id, ingredient_id in sorted(drift):
+                self.stdout.write(
+                    f'user={user_id} ingredient={ingredient_id}: '
+                    f'сохранено {stored.get((user_id, ingredient_id), 0)}, '
+                    f'ожидается {expected.get((user_id, ingredient_id), 0)}'
+                )
+            if drift:
+                raise CommandError(f'Расхождений: {len(drift)}')
+            self.stdout.write('Списки покупок актуальны')
+            return
+
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.bulk_create(
+                [
+                    ShoppingListItem(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=amount,
+                    )
+                    for (user_id, ingredient_id), amount in expected.items()
+                ],
+                batch_size=1000,
+            )
+        self.stdout.write(f'Пересобрано позиций: {len(expected)}')
@@ -0,0 +1,41 @@
+from django.core.management import BaseCommand
+from django.db.models import Count, F
+
+from recipes.models import Recipe
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает число добавлений в избранное у рецептов, '
+            'число рецептов и подписчиков у пользователей')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только показать расхождения, ничего не исправляя',
+        )
+
+    def handle(self, *args, **options):
+        self.recount(
+            Recipe, 'favorites_count', 'favoriterecipe', options['check'])
+        self.recount(User, 'recipes_count', 'recipes', options['check'])
+        self.recount(
+            User, 'subscribers_count', 'subscribers', options['check'])
+
+    def recount(self, model, field, relation, check):
+        drifted = list(
+            model.objects.annotate(
+                actual=Count(relation)
+            ).exclude(**{field: F('actual')}).only('pk', field)
+        )
+        for obj in drifted:
+            self.stdout.write(
+                f'{model.__name__} {obj.pk}: {field} '
+                f'{getattr(obj, field)} -> {obj.actual}'
+            )
+            setattr(obj, field, obj.actual)
+        if drifted and not check:
+            model.objects.bulk_update(drifted, [field], batch_size=1000)
+        self.stdout.write(
+            f'{model.__name__}.{field}: расхождений {len(drifted)}')
@@ -0,0 +1,230 @@
+import time
+from contextlib import ExitStack
+from itertools import count
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from recipes.models import FavoriteRecipe, Ingredient, Recipe, ShoppingCart
+from users.models import User, UserSubscribe
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=='
+)
+TRANSACTION_CONTROL = (
+    'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class Case:
+    '''Один замеряемый запрос.
+
+    url, data и headers могут быть функциями от номера итерации.
+    queries - бюджет SQL-запросов, baseline - ожидаемая медиана в мс на
+    данных команды benchmark по умолчанию.
+    '''
+
+    def __init__(self, name, url, queries, baseline, method='get',
+                 data=None, headers=None, status=200, anonymous=False):
+        self.name = name
+        self.url = url
+        self.queries = queries
+        self.baseline = baseline
+        self.method = method
+        self.data = data
+        self.headers = headers
+        self.status = status
+        self.anonymous = anonymous
+        self.timings = []
+        self.query_counts = []
+        self.errors = []
+
+    @property
+    def label(self):
+        url = self.url if isinstance(self.url, str) else self.name
+        return f'{self.method.upper()} {url}'
+
+    def resolve(self, value, iteration):
+        return value(iteration) if callable(value) else value
+
+    def run(self, client, iteration):
+        url = self.resolve(self.url, iteration)
+        kwargs = self.resolve(self.headers, iteration) or {}
+        data = self.resolve(self.data, iteration)
+        if data is not None:
+            kwargs.update(data=data, format='json')
+        # Чтение может уйти на реплики: запросы считаются по всем базам.
+        with ExitStack() as stack:
+            contexts = [
+                stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in connections
+            ]
+            started = time.perf_counter()
+            response = getattr(client, self.method)(url, **kwargs)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        if response.status_code != self.status:
+            self.errors.append(
+                f'{self.method.upper()} {url}: {response.status_code}')
+        # Точки сохранения появляются, только если запрос выполняется
+        # внутри транзакции, как в тестах, и в бюджет не входят.
+        return elapsed * 1000, sum(
+            1
+            for context in contexts
+            for query in context.captured_queries
+            if not query['sql'].startswith(TRANSACTION_CONTROL)
+        )
+
+
+def get_cases(reader, client, repeat):
+    '''Группы запросов к эндпоинтам API от имени reader с токеном в
+    client. Запросы группы выполняются по очереди на каждой итерации, так
+    пары добавить/удалить не мешают друг другу. Данных хватает на repeat
+    итераций.'''
+    own = list(Recipe.objects.filter(
+        author=reader).values_list('id', flat=True))
+    free = list(Recipe.objects.exclude(author=reader).exclude(
+        id__in=FavoriteRecipe.objects.filter(
+            user=reader).values('recipe_id')
+    ).exclude(
+        id__in=ShoppingCart.objects.filter(
+            user=reader).values('recipe_id')
+    ).values_list('id', flat=True)[:repeat * 10 + 10])
+    authors = list(User.objects.exclude(pk=reader.pk).exclude(
+        id__in=UserSubscribe.objects.filter(
+            subscriber=reader).values('target_user_id')
+    ).values_list('id', flat=True))
+    other_recipe = free[0]
+    ingredients = list(Ingredient.objects.values_list('id', flat=True))
+    tag_ids = list(reader.recipes.values_list(
+        'tags__id', flat=True).distinct()[:2])
+    names = count()
+
+    def create_payload(size):
+        return lambda i: {
+            'name': f'Замер {next(names)}',
+            'text': 'Смешать и запечь.',
+            'cooking_time': 30,
+            'image': IMAGE,
+            'tags': tag_ids,
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 10}
+                for ingredient_id in ingredients[:size]
+            ],
+        }
+
+    def update_payload(i):
+        return {
+            'name': f'Обновлённый рецепт {i}',
+            'text': 'Смешать и запечь.',
+            'cooking_time': 20 + i % 2,
+            'tags': tag_ids[:1 + i % 2],
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 10 + i % 2}
+                for ingredient_id in ingredients[i % 2:8 + i % 2]
+            ],
+        }
+
+    def if_none_match(url, anonymous):
+        def headers(i):
+            etag = (APIClient() if anonymous else client).get(url)['ETag']
+            return {'HTTP_IF_NONE_MATCH': etag}
+        return headers
+
+    def batch(i):
+        return {'recipes': free[i * 10 % len(free):][:10]}
+
+    def recipe_action(action):
+        return lambda i: (
+            f'/api/recipes/{free[i % len(free)]}/{action}/')
+
+    def created(i):
+        '''Рецепт, только что созданный в той же группе.'''
+        recipe_id = Recipe.objects.filter(author=reader).latest('id').pk
+        return f'/api/recipes/{recipe_id}/'
+
+    def subscribe(i):
+        return f'/api/users/{authors[i % len(authors)]}/subscribe/'
+
+    recipe = f'/api/recipes/{other_recipe}/'
+    return [
+        [Case('tags-list', '/api/tags/', 0, 2, anonymous=True)],
+        [Case('tags-detail', f'/api/tags/{tag_ids[0]}/', 0, 2,
+              anonymous=True)],
+        [Case('ingredients-list', '/api/ingredients/?name=Ингредиент 1', 0,
+              4, anonymous=True)],
+        [Case('ingredients-detail', f'/api/ingredients/{ingredients[0]}/', 0,
+              2, anonymous=True)],
+        [Case('recipes-list', '/api/recipes/', 5, 13, anonymous=True)],
+        [Case('recipes-list', '/api/recipes/', 6, 22)],
+        [Case('recipes-list', '/api/recipes/?limit=50', 6, 37)],
+        [Case('recipes-list', '/api/recipes/?paginate=cursor', 5, 21)],
+        [Case('recipes-list',
+              '/api/recipes/?tags=seed-tag-1&tags=seed-tag-2', 7, 23)],
+        [Case('recipes-list', '/api/recipes/?is_favorited=1', 6, 17)],
+        [Case('recipes-list', '/api/recipes/?is_in_shopping_cart=1', 6, 18)],
+        [Case('recipes-list', '/api/recipes/?search=запечь', 6, 19)],
+        [Case('recipes-list', '/api/recipes/', 3, 11, status=304,
+              headers=if_none_match('/api/recipes/', False))],
+        [Case('recipes-detail', recipe, 4, 8, anonymous=True)],
+        [Case('recipes-detail', recipe, 5, 15)],
+        [Case('recipes-detail', recipe, 2, 10, status=304,
+              headers=if_none_match(recipe, False))],
+        [
+            Case('recipes-create', '/api/recipes/', 20, 33, method='post',
+                 data=create_payload(8), status=201),
+            Case('recipes-shopping-cart',
+                 lambda i: f'{created(i)}shopping_cart/', 8, 13,
+                 method='post', status=201),
+            Case('recipes-delete', created, 16, 20, method='delete',
+                 status=204),
+        ],
+        [Case('recipes-create', '/api/recipes/', 21, 110, method='post',
+              data=create_payload(500), status=201)],
+        [Case('recipes-update', f'/api/recipes/{own[0]}/', 22, 43,
+              method='patch', data=update_payload)],
+        [
+            Case('recipes-favorite', recipe_action('favorite'), 5, 7,
+                 method='post', status=201),
+            Case('recipes-favorite', recipe_action('favorite'), 5, 6,
+                 method='delete', status=204),
+        ],
+        [
+            Case('recipes-favorite-batch', '/api/recipes/favorite/', 5, 7,
+                 method='post', data=batch, status=201),
+            Case('recipes-favorite-batch', '/api/recipes/favorite/', 5, 7,
+                 method='delete', data=batch),
+        ],
+        [
+            Case('recipes-shopping-cart', recipe_action('shopping_cart'), 8,
+                 13, method='post', status=201),
+            Case('recipes-shopping-cart', recipe_action('shopping_cart'), 7,
+                 11, method='delete', status=204),
+        ],
+        [
+            Case('recipes-shopping-cart-batch', '/api/recipes/shopping_cart/',
+                 8, 45, method='post', data=batch, status=201),
+            Case('recipes-shopping-cart-batch', '/api/recipes/shopping_cart/',
+                 7, 46, method='delete', data=batch),
+        ],
+        [Case('recipes-download-shopping-cart',
+              '/api/recipes/download_shopping_cart/', 2, 4)],
+        [Case('recipes-download-shopping-cart',
+              '/api/recipes/download_shopping_cart/?format=csv', 2, 4)],
+        [Case('recipes-favorites', '/api/recipes/favorites/', 2, 5)],
+        [Case('users-subscriptions', '/api/users/subscriptions/', 4, 26)],
+        [Case('users-subscriptions',
+              '/api/users/subscriptions/?recipes_limit=3', 4, 18)],
+        [
+            Case('users-subscribe', subscribe, 11, 19, method='post',
+                 status=201),
+            Case('users-subscribe', subscribe, 9, 12, method='delete',
+                 status=204),
+        ],
+        [Case('users-feed', '/api/users/feed/', 7, 32)],
+        [Case('users-me', '/api/users/me/', 2, 5)],
+        [Case('users-list', '/api/users/', 3, 7)],
+        [Case('users-detail', f'/api/users/{reader.pk}/', 2, 7)],
+    ]
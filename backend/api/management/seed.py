@@ -0,0 +1,163 @@
+import random
+import shutil
+import tempfile
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from recipes.images import executor
+from recipes.models import (FavoriteRecipe, Ingredient, IngredientAmount,
+                            Recipe, ShoppingCart, Tag, TagRecipe,
+                            TimelineEntry)
+from users.models import User, UserSubscribe
+
+SEED_IMAGE_NAME = 'images/seed.png'
+SEED_PASSWORD = 'seed-password'
+
+
+def seed_image():
+    '''Одно фото на все рецепты: файлы для каждого не нужны.'''
+    if not default_storage.exists(SEED_IMAGE_NAME):
+        buffer = BytesIO()
+        Image.new('RGB', (64, 64), 'orange').save(buffer, 'PNG')
+        default_storage.save(SEED_IMAGE_NAME, ContentFile(buffer.getvalue()))
+    return SEED_IMAGE_NAME
+
+
+def seed(users=50, recipes_per_user=10, ingredients=2000, tags=8,
+         ingredients_per_recipe=8, subscriptions=10, favorites=20,
+         cart=5, random_seed=0):
+    '''Заполняет базу правдоподобными данными.
+
+    Строки вставляются через bulk_create, денормализованные счётчики,
+    списки покупок и ленты подписок достраиваются штатными методами.
+    Возвращает первого пользователя: у него есть подписки, избранное и
+    корзина.
+    '''
+    rng = random.Random(random_seed)
+    image = seed_image()
+
+    # SQLite в Django 3.2 не возвращает id из bulk_create, поэтому
+    # созданные строки перечитываются.
+    Tag.objects.bulk_create(
+        Tag(name=f'Тег {i}', color=f'#{i:06X}', slug=f'seed-tag-{i}', bit=bit)
+        for i, bit in zip(range(tags), Tag.objects.free_bits())
+    )
+    tag_objects = list(Tag.objects.filter(
+        slug__startswith='seed-tag-').order_by('pk'))
+    Ingredient.objects.bulk_create(
+        (
+            Ingredient(name=f'Ингредиент {i}', measurement_unit='г')
+            for i in range(ingredients)
+        ),
+        batch_size=1000,
+    )
+    ingredient_objects = list(Ingredient.objects.filter(
+        name__startswith='Ингредиент ').order_by('pk'))
+    User.objects.bulk_create(
+        User(
+            email=f'seed{i}@example.com',
+            username=f'seed{i}',
+            first_name='Имя',
+            last_name='Фамилия',
+        )
+        for i in range(users)
+    )
+    user_objects = list(User.objects.filter(
+        username__startswith='seed').order_by('pk'))
+    user_objects[0].set_password(SEED_PASSWORD)
+    user_objects[0].save(update_fields=['password'])
+    Token.objects.get_or_create(user=user_objects[0])
+
+    Recipe.objects.bulk_create(
+        Recipe(
+            author=author,
+            name=f'Рецепт {author.username}-{i}',
+            text='Смешать и запечь. ' * rng.randint(5, 50),
+            image=image,
+            cooking_time=rng.randint(5, 180),
+        )
+        for author in user_objects
+        for i in range(recipes_per_user)
+    )
+    recipes = list(Recipe.objects.filter(
+        author__in=user_objects).order_by('pk'))
+    IngredientAmount.objects.bulk_create(
+        (
+            IngredientAmount(
+                recipe=recipe,
+                ingredient=ingredient,
+                amount=rng.randint(1, 500),
+            )
+            for recipe in recipes
+            for ingredient in rng.sample(
+                ingredient_objects, ingredients_per_recipe)
+        ),
+        batch_size=1000,
+    )
+    TagRecipe.objects.bulk_create(
+        (
+            TagRecipe(recipe=recipe, tag=tag)
+            for recipe in recipes
+            for tag in rng.sample(tag_objects, rng.randint(1, 3))
+        ),
+        batch_size=1000,
+    )
+    Recipe.objects.filter(author__in=user_objects).refresh_tags_mask()
+
+    UserSubscribe.objects.bulk_create(
+        UserSubscribe(subscriber=user, target_user=target)
+        for user in user_objects
+        for target in rng.sample(
+            [other for other in user_objects if other != user],
+            min(subscriptions, users - 1),
+        )
+    )
+    for user in user_objects:
+        FavoriteRecipe.objects.add(
+            user, [recipe.pk for recipe in rng.sample(recipes, favorites)])
+        ShoppingCart.objects.add(
+            user, [recipe.pk for recipe in rng.sample(recipes, cart)])
+
+    call_command('recount_counters', stdout=StringIO())
+    for author in user_objects:
+        TimelineEntry.objects.backfill(
+            author.pk,
+            UserSubscribe.objects.filter(
+                target_user=author,
+            ).values_list('subscriber_id', flat=True),
+        )
+    return user_objects[0]
+
+
+@contextmanager
+def seeded_test_database(**options):
+    '''Временная тестовая база, заполненная seed(**options).
+
+    Реплики из DB_REPLICAS на это время смотрят в неё же, файлы пишутся
+    во временный MEDIA_ROOT. Возвращает первого пользователя из seed().
+    '''
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False)
+    for alias in settings.DB_REPLICAS:
+        connections[alias].creation.set_as_test_mirror(
+            connection.settings_dict)
+    media_root = tempfile.mkdtemp()
+    try:
+        with override_settings(MEDIA_ROOT=media_root):
+            yield seed(**options)
+            executor.shutdown(wait=True)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        shutil.rmtree(media_root, ignore_errors=True)
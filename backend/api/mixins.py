@@ -0,0 +1,114 @@
+import hashlib
+from calendar import timegm
+
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+class ConditionalGetMixin:
+    '''Условные GET для list и retrieve.
+
+    Сначала выбираются лёгкие версии объектов страницы
+    (get_version_queryset), по полям version_fields строится ETag. Если он
+    совпал с If-None-Match, ответ 304 отдаётся без загрузки связанных
+    объектов и сериализации.
+    '''
+    version_fields = ()
+
+    def get_version_queryset(self):
+        raise NotImplementedError
+
+    def get_shared_versions(self):
+        '''Версии данных, общих для всех объектов ответа, например
+        справочников, из которых берутся вложенные поля.'''
+        return ()
+
+    def get_etag(self, versions, total):
+        digest = hashlib.md5(self.request.build_absolute_uri().encode())
+        digest.update(self.request.accepted_renderer.format.encode())
+        digest.update(str(total).encode())
+        digest.update(repr(list(self.get_shared_versions())).encode())
+        for version in versions:
+            digest.update(repr([
+                getattr(version, field, None)
+                for field in self.version_fields
+            ]).encode())
+        return quote_etag(digest.hexdigest())
+
+    def get_last_modified(self, versions):
+        return None
+
+    def represent(self, pks):
+        '''Данные объектов в порядке pks.'''
+        objects = self.get_queryset().in_bulk(pks)
+        return self.get_serializer(
+            [objects[pk] for pk in pks if pk in objects],
+            many=True,
+        ).data
+
+    def conditional_response(self, versions, total, get_response):
+        '''Ответ 304 или результат get_response с заголовками версии.
+
+        get_response возвращает пару (ответ, все ли объекты versions в нём
+        есть).
+        '''
+        etag = self.get_etag(versions, total)
+        last_modified = self.get_last_modified(versions)
+        response = get_conditional_response(
+            self.request,
+            etag=etag,
+            last_modified=(last_modified
+                           and timegm(last_modified.utctimetuple())),
+        )
+        if response is None:
+            response, complete = get_response()
+        else:
+            response, complete = Response(status=response.status_code), True
+        patch_vary_headers(response, ('Authorization',))
+        if not complete:
+            # Часть объектов удалена после чтения версий: ETag описывает
+            # другой набор, и такой ответ не должен кэшироваться.
+            return response
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(
+                timegm(last_modified.utctimetuple()))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_version_queryset())
+        versions = self.paginate_queryset(queryset)
+        if versions is None:
+            versions = list(queryset)
+        paginator = getattr(getattr(self.paginator, 'page', None),
+                            'paginator', None)
+        total = paginator.count if paginator else len(versions)
+
+        def get_response():
+            data = self.represent([version.pk for version in versions])
+            complete = len(data) == len(versions)
+            if self.paginator is None:
+                return Response(data), complete
+            return self.get_paginated_response(data), complete
+
+        return self.conditional_response(versions, total, get_response)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        version = get_object_or_404(
+            self.filter_queryset(self.get_version_queryset()),
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+        self.check_object_permissions(request, version)
+
+        def get_response():
+            data = self.represent([version.pk])
+            if not data:
+                # Объект удалён между чтением версии и данных.
+                raise Http404
+            return Response(data[0]), True
+
+        return self.conditional_response([version], 1, get_response)
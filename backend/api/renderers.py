@@ -0,0 +1,100 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Echo:
+    '''Псевдо-файл для csv.writer: возвращает строку вместо записи.'''
+
+    def write(self, value):
+        return value
+
+
+class ShoppingCartTextRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+    def stream(self, rows):
+        yield 'Список покупок:\n'
+        for ingredient_id, name, measurement_unit, amount in rows:
+            yield f'{name} - {amount} {measurement_unit}\n'
+
+
+class ShoppingCartCSVRenderer(ShoppingCartTextRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('ингредиент', 'количество', 'мера'))
+        for ingredient_id, name, measurement_unit, amount in rows:
+            yield writer.writerow((name, amount, measurement_unit))
+
+
+class ShoppingCartJSONRenderer(JSONRenderer):
+    charset = 'utf-8'
+
+    def stream(self, rows):
+        yield '['
+        separator = ''
+        for ingredient_id, name, measurement_unit, amount in rows:
+            yield separator + json.dumps(
+                {
+                    'id': ingredient_id,
+                    'name': name,
+                    'measurement_unit': measurement_unit,
+                    'amount': amount,
+                },
+                ensure_ascii=False,
+            )
+            separator = ','
+        yield ']'
+
+
+class ORJSONRenderer(JSONRenderer):
+    '''JSONRenderer на orjson с тем же результатом побайтно.
+
+    Без orjson, с отступами (browsable API) или при нестандартных
+    UNICODE_JSON/COMPACT_JSON работает как обычный JSONRenderer. Типы,
+    которых orjson не знает, включая даты, кодируются энкодером DRF.
+    '''
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii
+                or not self.compact
+                or self.get_indent(accepted_media_type,
+                                   renderer_context or {}) is not None):
+            return super().render(
+                data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME
+                | orjson.OPT_NON_STR_KEYS,
+            )
+        except orjson.JSONEncodeError:
+            return super().render(
+                data, accepted_media_type, renderer_context)
+        return ret.replace(
+            '\u2028'.encode(), b'\\u2028'
+        ).replace('\u2029'.encode(), b'\\u2029')
+
+
+SHOPPING_CART_RENDERERS = (
+    ShoppingCartTextRenderer,
+    ShoppingCartCSVRenderer,
+    ShoppingCartJSONRenderer,
+)
@@ -0,0 +1,61 @@
+import bisect
+import threading
+
+from api.cache import ingredient_cache
+
+
+class IngredientIndex:
+    '''Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Хранит отсортированные ключи (название в нижнем регистре, id):
+    совпадения по началу названия ищутся бинарным поиском, совпадения
+    по подстроке - перебором и выдаются после них. Индекс перестраивается,
+    когда меняется версия справочника в кэше.
+    '''
+
+    def __init__(self, source):
+        self.source = source
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = ([], {})
+
+    def _snapshot(self):
+        if self.source.version() != self._version:
+            with self._lock:
+                if self.source.version() != self._version:
+                    self._build()
+        return self._data
+
+    def _build(self):
+        version, rows = self.source.get()
+        items = {row['id']: row for row in rows}
+        keys = sorted(
+            (row['name'].casefold(), pk) for pk, row in items.items()
+        )
+        self._data = (keys, items)
+        self._version = version
+
+    def all(self):
+        keys, items = self._snapshot()
+        return list(items.values())
+
+    def get(self, pk):
+        keys, items = self._snapshot()
+        return items.get(pk)
+
+    def search(self, query):
+        keys, items = self._snapshot()
+        query = query.casefold()
+        found = []
+        position = bisect.bisect_left(keys, (query,))
+        while position < len(keys) and keys[position][0].startswith(query):
+            found.append(keys[position][1])
+            position += 1
+        found.extend(
+            pk for key, pk in keys
+            if query in key and not key.startswith(query)
+        )
+        return [items[pk] for pk in found]
+
+
+ingredient_index = IngredientIndex(ingredient_cache)
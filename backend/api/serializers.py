@@ -1,14 +1,19 @@
+from collections import Counter
+
 from django.core.exceptions import PermissionDenied
 from django.db import transaction
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
-from recipes.models import (FavoriteRecipe, Ingredient, IngredientAmount,
-                            Recipe, ShoppingCart, Tag, TagRecipe)
+from foodgram_backend.metrics import TimedRepresentationMixin
+from recipes.models import (TAG_BITS, FavoriteRecipe, Ingredient,
+                            IngredientAmount, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag, TagRecipe)
 from users.serializers import CustomUserSerializer
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedRepresentationMixin,
+                           serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
@@ -41,9 +46,10 @@ class IngredientAmountSerializer(IngredientSerializer):
         )
 
 
-class AddIngredientSerializer(serializers.ModelSerializer):
+class AddIngredientSerializer(TimedRepresentationMixin,
+                              serializers.ModelSerializer):
     id = serializers.IntegerField()
-    amount = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=1, max_value=32767)
 
     class Meta:
         model = IngredientAmount
@@ -53,14 +59,36 @@ class AddIngredientSerializer(serializers.ModelSerializer):
         )
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Tag
-        fields = '__all__'
+        fields = (
+            'id',
+            'name',
+            'color',
+            'slug',
+        )
+
+    def validate(self, attrs):
+        if self.instance is None and not Tag.objects.free_bits():
+            raise serializers.ValidationError(
+                f'Тегов не может быть больше {TAG_BITS}')
+        return attrs
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class DerivativeImageField(serializers.ImageField):
+    '''Ссылка на производное фото, пока его нет - на исходное.'''
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        return super().get_attribute(instance) or instance.image
+
+
+class RecipeSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     ingredients = IngredientAmountSerializer(
         many=True,
         source='ingredientamount_set',
@@ -70,6 +98,8 @@ class RecipeSerializer(serializers.ModelSerializer):
     author = CustomUserSerializer(read_only=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_thumbnail = DerivativeImageField()
+    image_webp = DerivativeImageField()
 
     class Meta:
         model = Recipe
@@ -82,6 +112,8 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_thumbnail',
+            'image_webp',
             'text',
             'cooking_time',
         )
@@ -90,6 +122,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return FavoriteRecipe.objects.filter(
             user=user,
             recipe=obj,
@@ -99,19 +133,19 @@ class RecipeSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return ShoppingCart.objects.filter(
             user=user,
             recipe=obj
         ).exists()
 
 
-class RecipeCreateSerializer(serializers.ModelSerializer):
+class RecipeCreateSerializer(TimedRepresentationMixin,
+                             serializers.ModelSerializer):
     image = Base64ImageField()
     ingredients = AddIngredientSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True,
-        queryset=Tag.objects.all()
-    )
+    tags = serializers.ListField(child=serializers.IntegerField())
     author = CustomUserSerializer(read_only=True)
     cooking_time = serializers.IntegerField(min_value=1)
 
@@ -128,25 +162,45 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             'cooking_time',
         )
 
+    def validate_ingredients(self, value):
+        '''Проверяет все id ингредиентов одним запросом.'''
+        existing = set(Ingredient.objects.filter(
+            id__in={ingredient['id'] for ingredient in value}
+        ).values_list('id', flat=True))
+        seen = set()
+        errors = []
+        for ingredient in value:
+            if ingredient['id'] not in existing:
+                errors.append({'id': [
+                    f'Ингредиента с id={ingredient["id"]} не существует']})
+            elif ingredient['id'] in seen:
+                errors.append({'id': ['Данный ингредиент уже добавлен']})
+            else:
+                errors.append({})
+            seen.add(ingredient['id'])
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return value
+
+    def validate_tags(self, value):
+        existing = set(Tag.objects.filter(
+            id__in=set(value)
+        ).values_list('id', flat=True))
+        seen = set()
+        errors = {}
+        for index, tag_id in enumerate(value):
+            if tag_id not in existing:
+                errors[index] = [f'Тега с id={tag_id} не существует']
+            elif tag_id in seen:
+                errors[index] = ['Данный тег уже добавлен']
+            seen.add(tag_id)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return value
+
     def validate(self, data):
         author = self.context['request'].user
         name = data.get('name')
-        ingredients_list = []
-
-        for ingredient in data['ingredients']:
-            amount = ingredient['amount']
-
-            if amount < 1:
-                raise serializers.ValidationError(
-                    {'amount':
-                     'Убедитесь, что это значение больше либо равно 1'}
-                )
-
-            if ingredient['id'] in ingredients_list:
-                raise serializers.ValidationError(
-                    {'error': 'Данный ингредиент уже добавлен'}
-                )
-            ingredients_list.append(ingredient['id'])
 
         if self.instance is not None:
             if self.instance.author != author:
@@ -160,24 +214,62 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
         return data
 
-    def recipe_create_or_update(self, ingredients, tags, recipe):
-        ingredient_amount = [
+    def set_ingredients(self, recipe, ingredients):
+        '''Приводит ингредиенты рецепта к переданным, затрагивая только
+        изменившиеся строки. Возвращает изменения количеств.'''
+        new_amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        current = {
+            ingredient_amount.ingredient_id: ingredient_amount
+            for ingredient_amount
+            in IngredientAmount.objects.filter(recipe=recipe)
+        }
+        deltas = Counter(new_amounts)
+        deltas.subtract({
+            ingredient_id: ingredient_amount.amount
+            for ingredient_id, ingredient_amount in current.items()
+        })
+
+        removed = current.keys() - new_amounts.keys()
+        if removed:
+            IngredientAmount.objects.filter(
+                recipe=recipe,
+                ingredient_id__in=removed,
+            ).delete()
+        IngredientAmount.objects.bulk_create([
             IngredientAmount(
                 recipe=recipe,
-                ingredient_id=ingredient['id'],
-                amount=ingredient['amount']
+                ingredient_id=ingredient_id,
+                amount=new_amounts[ingredient_id],
             )
-            for ingredient in ingredients
-        ]
-        IngredientAmount.objects.bulk_create(ingredient_amount)
-
-        tag_recipe = [
-            TagRecipe(recipe=recipe, tag=tag)
-            for tag in tags
-        ]
-        TagRecipe.objects.bulk_create(tag_recipe)
-
-        recipe.tags.set(tags)
+            for ingredient_id in new_amounts.keys() - current.keys()
+        ])
+        changed = []
+        for ingredient_id, ingredient_amount in current.items():
+            amount = new_amounts.get(ingredient_id)
+            if amount is not None and amount != ingredient_amount.amount:
+                ingredient_amount.amount = amount
+                changed.append(ingredient_amount)
+        IngredientAmount.objects.bulk_update(changed, ['amount'])
+        return deltas
+
+    def set_tags(self, recipe, tags):
+        new_tags = set(tags)
+        current = set(TagRecipe.objects.filter(
+            recipe=recipe
+        ).values_list('tag_id', flat=True))
+
+        if current - new_tags:
+            TagRecipe.objects.filter(
+                recipe=recipe,
+                tag_id__in=current - new_tags,
+            ).delete()
+        TagRecipe.objects.bulk_create([
+            TagRecipe(recipe=recipe, tag_id=tag_id)
+            for tag_id in new_tags - current
+        ])
 
     @transaction.atomic
     def create(self, validated_data):
@@ -186,31 +278,37 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         author = self.context.get('request').user
         recipe = Recipe.objects.create(
             author=author,
+            tags_mask=Tag.objects.mask(tags),
             **validated_data
         )
 
-        self.recipe_create_or_update(ingredients, tags, recipe)
+        self.set_ingredients(recipe, ingredients)
+        self.set_tags(recipe, tags)
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        TagRecipe.objects.filter(recipe=instance).delete()
-        IngredientAmount.objects.filter(recipe=instance).delete()
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
+        validated_data['tags_mask'] = Tag.objects.mask(tags)
 
-        self.recipe_create_or_update(ingredients, tags, instance)
+        deltas = self.set_ingredients(instance, ingredients)
+        self.set_tags(instance, tags)
+        ShoppingListItem.objects.change_recipe(instance.pk, deltas)
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        request = self.context.get('request')
         return RecipeSerializer(
-            instance,
-            context={'request': self.context.get('request')}
+            Recipe.objects.for_user(request.user).get(pk=instance.pk),
+            context={'request': request}
         ).data
 
 
-class SubscribeFavoriteRecipeSerializer(serializers.ModelSerializer):
+class SubscribeFavoriteRecipeSerializer(TimedRepresentationMixin,
+                                        serializers.ModelSerializer):
+    image_thumbnail = DerivativeImageField()
+    image_webp = DerivativeImageField()
 
     class Meta:
         model = Recipe
@@ -218,12 +316,14 @@ class SubscribeFavoriteRecipeSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_thumbnail',
+            'image_webp',
             'cooking_time',
         )
 
 
 class SubscribeSerializer(CustomUserSerializer):
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    recipes_count = serializers.ReadOnlyField()
     recipes = SubscribeFavoriteRecipeSerializer(many=True, read_only=True)
 
     class Meta(CustomUserSerializer.Meta):
@@ -237,12 +337,30 @@ class SubscribeSerializer(CustomUserSerializer):
             'last_name',
         )
 
-    def get_recipes_count(self, obj):
-        recipes = Recipe.objects.filter(author=obj.id)
-        return recipes.count()
 
+class RecipeIdsSerializer(TimedRepresentationMixin, serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=1000,
+    )
 
-class FavoriteSerializer(serializers.ModelSerializer):
+    def validate_recipes(self, value):
+        existing = set(Recipe.objects.filter(
+            id__in=set(value)
+        ).values_list('id', flat=True))
+        errors = {
+            index: [f'Рецепта с id={recipe_id} не существует']
+            for index, recipe_id in enumerate(value)
+            if recipe_id not in existing
+        }
+        if errors:
+            raise serializers.ValidationError(errors)
+        return value
+
+
+class FavoriteSerializer(TimedRepresentationMixin,
+                         serializers.ModelSerializer):
 
     class Meta:
         model = FavoriteRecipe
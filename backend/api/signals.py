@@ -0,0 +1,40 @@
+from django.core.signals import request_started
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import invalidate_tokens, invalidate_user
+from api.cache import ingredient_cache, tag_cache
+from api.db import check_connections
+from recipes.models import Ingredient, Tag
+from users.models import User
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_cache(sender, **kwargs):
+    tag_cache.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_cache(sender, **kwargs):
+    ingredient_cache.invalidate()
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(request_started)
+def check_reused_connections(sender, **kwargs):
+    '''Срабатывает после close_old_connections, который Django подключает
+    к тому же сигналу раньше.'''
+    check_connections()
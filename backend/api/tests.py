@@ -0,0 +1,1140 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import (AsyncClient, RequestFactory, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
+
+from api.authentication import CachedTokenAuthentication, token_cache_key
+from api.cache import tag_cache
+from api.management.endpoints import get_cases
+from api.management.seed import seed
+from api.serializers import RecipeCreateSerializer, RecipeSerializer
+from api.views import RecipeViewSet
+from foodgram_backend.db_router import (ReplicaRouter,
+                                        ReplicaRoutingMiddleware)
+from recipes.images import build_derivatives
+from recipes.models import (FavoriteRecipe, Ingredient, IngredientAmount,
+                            Recipe, ShoppingCart, ShoppingListItem, Tag,
+                            TagRecipe, TimelineEntry)
+from users.models import User, UserSubscribe
+
+PASSWORD = 'Secret-password-1'
+
+
+class FoodgramTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г')
+
+    def setUp(self):
+        cache.clear()
+
+    def create_user(self, name):
+        return User.objects.create_user(
+            email=f'{name}@example.com',
+            username=name,
+            first_name='Имя',
+            last_name='Фамилия',
+            password=PASSWORD,
+        )
+
+    def client_for(self, user):
+        client = APIClient()
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def create_recipe(self, author, name='Блины'):
+        return Recipe.objects.create(
+            author=author,
+            name=name,
+            text='Смешать и пожарить.',
+            cooking_time=20,
+            image='images/test.png',
+        )
+
+    def recipe_payload(self, name='Блины'):
+        return {
+            'name': name,
+            'text': 'Смешать и пожарить.',
+            'cooking_time': 25,
+            'tags': [self.tag.pk],
+            'ingredients': [{'id': self.ingredient.pk, 'amount': 100}],
+        }
+
+
+class CounterFieldsTests(FoodgramTestCase):
+    '''Полное сохранение объекта не затирает счётчики.'''
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.reader = self.create_user('reader')
+        self.author_client = self.client_for(self.author)
+        # Копия автора в памяти запроса устаревает после изменения
+        # счётчиков.
+        self.author_client.get('/api/users/me/')
+        self.recipe = self.create_recipe(self.author)
+        reader_client = self.client_for(self.reader)
+        reader_client.post(f'/api/users/{self.author.pk}/subscribe/')
+        reader_client.post(f'/api/recipes/{self.recipe.pk}/favorite/')
+
+    def assertCounters(self):
+        self.author.refresh_from_db()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+        self.assertEqual(self.author.subscribers_count, 1)
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+    def test_set_password(self):
+        self.assertCounters()
+        response = self.author_client.post('/api/users/set_password/', {
+            'current_password': PASSWORD,
+            'new_password': 'Other-password-2',
+        })
+        self.assertEqual(response.status_code, 204)
+        self.assertCounters()
+
+    def test_patch_me(self):
+        response = self.author_client.patch(
+            '/api/users/me/', {'first_name': 'Новое'})
+        self.assertEqual(response.status_code, 200)
+        self.assertCounters()
+
+    def test_stale_copy_save(self):
+        stale = User.objects.get(pk=self.author.pk)
+        stale.recipes_count = stale.subscribers_count = 0
+        stale.first_name = 'Новое'
+        stale.save()
+        stale_recipe = Recipe.objects.get(pk=self.recipe.pk)
+        stale_recipe.favorites_count = 0
+        stale_recipe.save()
+        self.assertCounters()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.first_name, 'Новое')
+
+    def test_recipe_update(self):
+        response = self.author_client.patch(
+            f'/api/recipes/{self.recipe.pk}/',
+            self.recipe_payload('Оладьи'),
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertCounters()
+
+
+@override_settings(CACHE_SHARED=True)
+class TokenCacheTests(FoodgramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('user')
+        self.client = self.client_for(self.user)
+        self.key = Token.objects.get(user=self.user).key
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+
+    def test_no_queries_when_cached(self):
+        self.assertEqual(cache.get(token_cache_key(self.key)), self.user.pk)
+        with self.assertNumQueries(0):
+            user, token = (
+                CachedTokenAuthentication().authenticate_credentials(self.key))
+        self.assertEqual(user, self.user)
+
+    def test_user_saved(self):
+        self.user.first_name = 'Новое'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.json()['first_name'], 'Новое')
+
+    def test_counters_are_read_fresh(self):
+        User.objects.filter(pk=self.user.pk).update(recipes_count=5)
+        user, token = (
+            CachedTokenAuthentication().authenticate_credentials(self.key))
+        self.assertEqual(user.recipes_count, 5)
+
+    def test_inactive_user(self):
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_deleted_user(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_logout(self):
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(cache.get(token_cache_key(self.key)))
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    @override_settings(CACHE_SHARED=False)
+    def test_not_cached_without_shared_backend(self):
+        cache.clear()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        self.assertIsNone(cache.get(token_cache_key(self.key)))
+
+
+class ShoppingCartExportTests(FoodgramTestCase):
+    '''Выгрузка списка покупок суммирует ингредиенты всех рецептов.'''
+
+    def setUp(self):
+        super().setUp()
+        author = self.create_user('author')
+        self.user = self.create_user('user')
+        self.client = self.client_for(self.user)
+        self.sugar = Ingredient.objects.create(
+            name='Сахар', measurement_unit='г')
+        pancakes = self.create_recipe(author, 'Блины')
+        IngredientAmount.objects.create(
+            recipe=pancakes, ingredient=self.ingredient, amount=200)
+        IngredientAmount.objects.create(
+            recipe=pancakes, ingredient=self.sugar, amount=50)
+        fritters = self.create_recipe(author, 'Оладьи')
+        IngredientAmount.objects.create(
+            recipe=fritters, ingredient=self.ingredient, amount=100)
+        for recipe in (pancakes, fritters):
+            response = self.client.post(
+                f'/api/recipes/{recipe.pk}/shopping_cart/')
+            self.assertEqual(response.status_code, 201)
+
+    def download(self, query=''):
+        response = self.client.get(
+            f'/api/recipes/download_shopping_cart/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_txt(self):
+        response, body = self.download()
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename=shopping_cart.txt',
+        )
+        self.assertEqual(
+            body, 'Список покупок:\nМука - 300 г\nСахар - 50 г\n')
+
+    def test_csv(self):
+        response, body = self.download('?format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename=shopping_cart.csv',
+        )
+        self.assertEqual(body.splitlines(), [
+            'ингредиент,количество,мера',
+            'Мука,300,г',
+            'Сахар,50,г',
+        ])
+
+    def test_json(self):
+        response, body = self.download('?format=json')
+        self.assertEqual(
+            response['Content-Type'], 'application/json; charset=utf-8')
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename=shopping_cart.json',
+        )
+        self.assertEqual(json.loads(body), [
+            {'id': self.ingredient.pk, 'name': 'Мука',
+             'measurement_unit': 'г', 'amount': 300},
+            {'id': self.sugar.pk, 'name': 'Сахар',
+             'measurement_unit': 'г', 'amount': 50},
+        ])
+
+    def test_anonymous(self):
+        response = APIClient().get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, 401)
+
+
+class RecipeValidationTests(FoodgramTestCase):
+    '''Ошибки ингредиентов и тегов привязаны к позициям в списке.'''
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.client = self.client_for(self.author)
+        self.recipe = self.create_recipe(self.author)
+
+    def patch(self, **fields):
+        payload = self.recipe_payload()
+        payload.update(fields)
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        return response.json()
+
+    def test_ingredient_errors(self):
+        errors = self.patch(ingredients=[
+            {'id': self.ingredient.pk, 'amount': 100},
+            {'id': 0, 'amount': 1},
+            {'id': self.ingredient.pk, 'amount': 5},
+        ])
+        self.assertEqual(errors['ingredients'], [
+            {},
+            {'id': ['Ингредиента с id=0 не существует']},
+            {'id': ['Данный ингредиент уже добавлен']},
+        ])
+
+    def test_ingredient_amount(self):
+        errors = self.patch(ingredients=[
+            {'id': self.ingredient.pk, 'amount': 100},
+            {'id': self.ingredient.pk, 'amount': 0},
+        ])
+        self.assertEqual(errors['ingredients'][0], {})
+        self.assertIn('amount', errors['ingredients'][1])
+
+    def test_tag_errors(self):
+        errors = self.patch(tags=[self.tag.pk, 0, self.tag.pk])
+        self.assertEqual(errors['tags'], {
+            '1': ['Тега с id=0 не существует'],
+            '2': ['Данный тег уже добавлен'],
+        })
+
+    def test_one_query_per_table(self):
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {i}', measurement_unit='г')
+            for i in range(10)
+        ]
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {i}', color='#E26C2D', slug=f'tag-{i}')
+            for i in range(5)
+        ]
+        serializer = RecipeCreateSerializer()
+        with CaptureQueriesContext(connection) as context:
+            serializer.validate_ingredients([
+                {'id': ingredient.pk, 'amount': 1}
+                for ingredient in ingredients
+            ])
+            serializer.validate_tags([tag.pk for tag in tags])
+        self.assertEqual(len(context.captured_queries), 2)
+        for query in context.captured_queries:
+            self.assertIn(' IN (', query['sql'])
+
+
+class BuildImageDerivativesTests(FoodgramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.author = self.create_user('author')
+
+    def save_file(self, name, content):
+        return default_storage.save(f'images/{name}', ContentFile(content))
+
+    def test_builds_all_and_reports_broken(self):
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'orange').save(buffer, 'PNG')
+        good = [
+            self.create_recipe(self.author, f'Рецепт {i}')
+            for i in range(4)
+        ]
+        for recipe in good:
+            Recipe.objects.filter(pk=recipe.pk).update(
+                image=self.save_file('photo.png', buffer.getvalue()))
+        broken = self.create_recipe(self.author, 'Битое фото')
+        Recipe.objects.filter(pk=broken.pk).update(
+            image=self.save_file('broken.png', b'not an image'))
+
+        out = StringIO()
+        with self.assertLogs('recipes.images', 'ERROR'):
+            call_command('build_image_derivatives', stdout=out)
+
+        self.assertIn('Обработано фото: 4, ошибок: 1', out.getvalue())
+        for recipe in good:
+            recipe.refresh_from_db()
+            self.assertTrue(recipe.image_thumbnail.name)
+            self.assertTrue(recipe.image_webp.name)
+        broken.refresh_from_db()
+        self.assertFalse(broken.image_thumbnail.name)
+
+    def photo(self, name):
+        buffer = BytesIO()
+        Image.new('RGB', (80, 60), 'orange').save(buffer, 'PNG')
+        return self.save_file(name, buffer.getvalue())
+
+    def derivatives(self, recipe):
+        recipe.refresh_from_db()
+        names = (recipe.image_thumbnail.name, recipe.image_webp.name)
+        self.assertTrue(all(names))
+        return names
+
+    def assertFilesExist(self, names, exist=True):
+        for name in names:
+            self.assertEqual(default_storage.exists(name), exist, name)
+
+    def test_old_derivatives_deleted(self):
+        recipe = self.create_recipe(self.author)
+        Recipe.objects.filter(pk=recipe.pk).update(image=self.photo('a.png'))
+        build_derivatives(recipe.pk)
+        old = self.derivatives(recipe)
+        Recipe.objects.filter(pk=recipe.pk).update(image=self.photo('b.png'))
+        build_derivatives(recipe.pk)
+        new = self.derivatives(recipe)
+        self.assertFalse(set(old) & set(new))
+        self.assertFilesExist(old, exist=False)
+        self.assertFilesExist(new)
+
+    def test_deleted_with_last_recipe(self):
+        photo = self.photo('shared.png')
+        recipes = [
+            self.create_recipe(self.author, f'Рецепт {i}') for i in range(2)
+        ]
+        for recipe in recipes:
+            Recipe.objects.filter(pk=recipe.pk).update(image=photo)
+            build_derivatives(recipe.pk)
+        names = self.derivatives(recipes[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            recipes[0].delete()
+        self.assertFilesExist(names)
+        recipes[1].refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            recipes[1].delete()
+        self.assertFilesExist(names, exist=False)
+
+
+class RecipeRepresentationTests(FoodgramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe(self.create_user('author'))
+        TagRecipe.objects.create(recipe=self.recipe, tag=self.tag)
+
+    def test_tag_missing_from_cache(self):
+        tag_cache.rows()
+        # Инвалидация не дошла: в кэше нет нового тега.
+        with mock.patch.object(tag_cache, 'invalidate'):
+            tag = Tag.objects.create(
+                name='Обед', color='#49B64E', slug='lunch')
+        TagRecipe.objects.create(recipe=self.recipe, tag=tag)
+        response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [tag['slug'] for tag in response.json()['tags']],
+            ['breakfast', 'lunch'],
+        )
+
+    def test_retrieve_deleted_during_request(self):
+        with mock.patch(
+            'api.views.RecipeViewSet.represent', return_value=[]
+        ):
+            response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 404)
+
+
+class ConditionalGetTests(FoodgramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.recipe = self.create_recipe(self.author)
+        TagRecipe.objects.create(recipe=self.recipe, tag=self.tag)
+        self.etag = self.get_etag()
+
+    def get_etag(self):
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_not_modified(self):
+        response = self.client.get(
+            '/api/recipes/', HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_author_profile_changed(self):
+        response = self.client_for(self.author).patch(
+            '/api/users/me/', {'first_name': 'Новое'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(self.get_etag(), self.etag)
+
+    def test_tag_changed(self):
+        self.tag.color = '#000000'
+        self.tag.save()
+        self.assertNotEqual(self.get_etag(), self.etag)
+
+    def test_tag_changed_without_signals(self):
+        Tag.objects.filter(pk=self.tag.pk).update(name='Ужин')
+        tag_cache.invalidate()
+        self.assertNotEqual(self.get_etag(), self.etag)
+
+    def test_no_etag_for_incomplete_page(self):
+        with mock.patch(
+            'api.views.RecipeViewSet.represent', return_value=[]
+        ):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+
+@override_settings(DB_REPLICAS=['replica_1', 'replica_2', 'replica_3'])
+class ReplicaRoutingTests(FoodgramTestCase):
+
+    def test_one_replica_per_request(self):
+        router = ReplicaRouter()
+        aliases = []
+
+        def view(request):
+            for _ in range(20):
+                aliases.append(router.db_for_read(Recipe))
+            return None
+
+        middleware = ReplicaRoutingMiddleware(view)
+        request = RequestFactory().get('/api/recipes/')
+        with mock.patch(
+            'foodgram_backend.db_router.random.choice',
+            wraps=lambda replicas: replicas[-1],
+        ) as choice:
+            middleware.process_view(
+                request, RecipeViewSet.as_view({'get': 'list'}), (), {})
+            middleware(request)
+        choice.assert_called_once()
+        self.assertEqual(set(aliases), {'replica_3'})
+        self.assertEqual(router.db_for_read(Recipe), 'default')
+
+    async def test_async_request(self):
+        router = ReplicaRouter()
+        aliases = []
+
+        async def view(request):
+            aliases.append(router.db_for_read(Recipe))
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        request = RequestFactory().get('/api/recipes/')
+        with mock.patch(
+            'foodgram_backend.db_router.random.choice',
+            wraps=lambda replicas: replicas[0],
+        ):
+            await middleware.process_view(
+                request, RecipeViewSet.as_view({'get': 'list'}), (), {})
+            await middleware(request)
+        self.assertEqual(aliases, ['replica_1'])
+        self.assertEqual(router.db_for_read(Recipe), 'default')
+
+    @override_settings(DB_REPLICAS=[])
+    def test_not_used_without_replicas(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaRoutingMiddleware(lambda request: None)
+
+
+class TagsFilterTests(FoodgramTestCase):
+    '''Фильтр по тегам работает по tags_mask рецепта.'''
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.lunch = Tag.objects.create(
+            name='Обед', color='#49B64E', slug='lunch')
+        self.dinner = Tag.objects.create(
+            name='Ужин', color='#8775D2', slug='dinner')
+        self.both = self.create_recipe(self.author, 'Блины')
+        self.lunch_only = self.create_recipe(self.author, 'Суп')
+        self.dinner_only = self.create_recipe(self.author, 'Рагу')
+        for recipe, tags in ((self.both, (self.tag, self.lunch)),
+                             (self.lunch_only, (self.lunch,)),
+                             (self.dinner_only, (self.dinner,))):
+            for tag in tags:
+                TagRecipe.objects.create(recipe=recipe, tag=tag)
+        Recipe.objects.refresh_tags_mask()
+
+    def filtered(self, query):
+        response = self.client.get(f'/api/recipes/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return {recipe['id'] for recipe in response.json()['results']}
+
+    def test_any_and_all(self):
+        query = 'tags=breakfast&tags=lunch'
+        expected = {self.both.pk, self.lunch_only.pk}
+        self.assertEqual(self.filtered(query), expected)
+        self.assertEqual(self.filtered(f'{query}&tags_mode=any'), expected)
+        self.assertEqual(
+            self.filtered(f'{query}&tags_mode=all'), {self.both.pk})
+
+    def test_recipe_tags_changed(self):
+        payload = self.recipe_payload('Блины')
+        payload['tags'] = [self.dinner.pk]
+        response = self.client_for(self.author).patch(
+            f'/api/recipes/{self.both.pk}/', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.filtered('tags=breakfast'), set())
+        self.assertEqual(
+            self.filtered('tags=dinner'),
+            {self.both.pk, self.dinner_only.pk},
+        )
+
+    def test_deleted_tag_bit_reused(self):
+        bit = self.lunch.bit
+        self.lunch.delete()
+        snack = Tag.objects.create(
+            name='Перекус', color='#E26C2D', slug='snack')
+        self.assertEqual(snack.bit, bit)
+        self.assertEqual(self.filtered('tags=snack'), set())
+        self.assertEqual(self.filtered('tags=breakfast'), {self.both.pk})
+        self.assertEqual(
+            Recipe.objects.get(pk=self.lunch_only.pk).tags_mask, 0)
+
+
+class ReferenceCacheTests(FoodgramTestCase):
+
+    def test_version_is_not_a_hit(self):
+        tag_cache.reset_stats()
+        tag_cache.rows()
+        for _ in range(3):
+            tag_cache.version()
+        tag_cache.rows()
+        self.assertEqual(tag_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_flushed_on_timer(self):
+        tag_cache.invalidate()
+        tag_cache.reset_stats()
+        tag_cache.rows()
+        self.assertIsNone(cache.get(f'{tag_cache.key}:hits'))
+        with mock.patch('api.cache.STATS_FLUSH_SECONDS', 0):
+            tag_cache.rows()
+        self.assertEqual(cache.get(f'{tag_cache.key}:hits'), 1)
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_process_counters_on_metrics(self):
+        tag_cache.invalidate()
+        hits = tag_cache.totals['hits']
+        tag_cache.rows()
+        tag_cache.rows()
+        response = self.client.get('/metrics/')
+        self.assertIn(
+            f'foodgram_reference_cache_hits_total{{cache="tags"}} {hits + 1}',
+            response.content.decode(),
+        )
+
+    def test_invalidate_changes_version(self):
+        version = tag_cache.version()
+        tag_cache.invalidate()
+        self.assertNotEqual(tag_cache.version(), version)
+
+    def test_build_racing_invalidate_is_not_served(self):
+        build = tag_cache.build
+
+        def racing_build():
+            rows = build()
+            Tag.objects.filter(pk=self.tag.pk).update(name='Ужин')
+            tag_cache.invalidate()
+            return rows
+
+        with mock.patch.object(tag_cache, 'build', racing_build):
+            self.assertEqual(tag_cache.rows()[0]['name'], 'Завтрак')
+        self.assertEqual(tag_cache.rows()[0]['name'], 'Ужин')
+
+
+class IngredientIndexTests(FoodgramTestCase):
+    '''Поиск ингредиентов по индексу в памяти процесса.'''
+
+    def setUp(self):
+        super().setUp()
+        for name in ('Рисовая мука', 'Сахар', 'Мука ржаная'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def search(self, name):
+        response = self.client.get('/api/ingredients/', {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.json()]
+
+    def test_prefix_before_substring(self):
+        self.assertEqual(
+            self.search('МУК'), ['Мука', 'Мука ржаная', 'Рисовая мука'])
+
+    def test_rebuilt_after_change(self):
+        self.assertEqual(self.search('мус'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            nutmeg = Ingredient.objects.create(
+                name='Мускатный орех', measurement_unit='г')
+        self.assertEqual(self.search('мус'), ['Мускатный орех'])
+        with self.captureOnCommitCallbacks(execute=True):
+            nutmeg.delete()
+        self.assertEqual(self.search('мус'), [])
+
+
+class ExtractDbTests(FoodgramTestCase):
+    '''Импорт ингредиентов из CSV и JSON можно повторять.'''
+
+    def setUp(self):
+        super().setUp()
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir, ignore_errors=True)
+        data_dir = os.path.join(base_dir, 'data')
+        os.mkdir(data_dir)
+        with open(os.path.join(data_dir, 'ingredients.csv'), 'w',
+                  encoding='utf-8') as file:
+            file.write('ингредиент,мера\nМука,г\nСахар,г\n Соль ,г\n')
+        with open(os.path.join(data_dir, 'ingredients.json'), 'w',
+                  encoding='utf-8') as file:
+            json.dump([
+                {'name': 'Сахар', 'measurement_unit': 'г'},
+                {'name': 'Молоко', 'measurement_unit': 'мл'},
+            ], file, ensure_ascii=False)
+        settings = override_settings(BASE_DIR=base_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_repeated_import(self):
+        expected = {
+            ('Молоко', 'мл'),
+            ('Мука', 'г'),
+            ('Сахар', 'г'),
+            ('Соль', 'г'),
+        }
+        for _ in range(2):
+            call_command('extract_db', '--batch-size', '2', stdout=StringIO())
+            self.assertEqual(
+                list(Ingredient.objects.values_list(
+                    'name', 'measurement_unit').order_by('name')),
+                sorted(expected),
+            )
+
+
+class CursorPaginationTests(FoodgramTestCase):
+    '''?paginate=cursor проходит все записи без повторов и пропусков,
+    даже когда время публикации совпадает.'''
+
+    def setUp(self):
+        super().setUp()
+        self.reader = self.create_user('reader')
+        self.client = self.client_for(self.reader)
+        self.authors = [self.create_user(f'author{i}') for i in range(7)]
+        for author in self.authors:
+            self.create_recipe(author, f'Рецепт {author.username}')
+        Recipe.objects.update(pub_date=timezone.now())
+
+    def walk(self, url):
+        found = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            found.extend(item['id'] for item in response.json()['results'])
+            url = response.json()['next']
+            if url:
+                self.assertIn('cursor=', url)
+        return found
+
+    def test_recipes(self):
+        expected = list(Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('id', flat=True))
+        for limit in (1, 2, 3):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.walk(
+                    f'/api/recipes/?paginate=cursor&limit={limit}'), expected)
+
+    def test_subscriptions(self):
+        for author in self.authors:
+            UserSubscribe.objects.create(
+                subscriber=self.reader, target_user=author)
+        expected = [author.pk for author in reversed(self.authors)]
+        for limit in (1, 2, 3):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.walk(
+                    '/api/users/subscriptions/?paginate=cursor'
+                    f'&limit={limit}'), expected)
+
+
+class RecipeListQueriesTests(FoodgramTestCase):
+    '''Число запросов списка рецептов не растёт с размером страницы.'''
+
+    def setUp(self):
+        super().setUp()
+        author = self.create_user('author')
+        self.reader = self.create_user('reader')
+        for i in range(10):
+            recipe = self.create_recipe(author, f'Рецепт {i}')
+            TagRecipe.objects.create(recipe=recipe, tag=self.tag)
+            IngredientAmount.objects.create(
+                recipe=recipe, ingredient=self.ingredient, amount=i + 1)
+
+    def assertConstantQueries(self, client):
+        # Первый запрос заполняет кэш справочника тегов.
+        client.get('/api/recipes/?limit=1')
+        with CaptureQueriesContext(connection) as context:
+            response = client.get('/api/recipes/?limit=1')
+        self.assertEqual(len(response.json()['results']), 1)
+        with self.assertNumQueries(len(context)):
+            response = client.get('/api/recipes/?limit=10')
+        self.assertEqual(len(response.json()['results']), 10)
+
+    def test_anonymous(self):
+        self.assertConstantQueries(self.client)
+
+    def test_authenticated(self):
+        self.assertConstantQueries(self.client_for(self.reader))
+
+
+@override_settings(FEED_FANOUT_LIMIT=2)
+class FeedTests(FoodgramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.readers = [self.create_user(f'reader{i}') for i in range(2)]
+        self.reader_client = self.client_for(self.readers[0])
+        # Фото рецептов здесь не нужны, пул потоков не запускается.
+        executor = mock.patch('recipes.images.executor')
+        executor.start()
+        self.addCleanup(executor.stop)
+
+    def subscribe(self, reader):
+        response = self.client_for(reader).post(
+            f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+
+    def publish(self, name='Блины', author=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.create_recipe(author or self.author, name)
+
+    def feed_ids(self, url='/api/users/feed/'):
+        response = self.reader_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_fan_out_reads_fresh_count(self):
+        for reader in self.readers:
+            self.subscribe(reader)
+        # self.author прочитан до подписок: в нём subscribers_count = 0.
+        self.publish()
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    def test_backfill_when_author_stops_being_popular(self):
+        for reader in self.readers:
+            self.subscribe(reader)
+        recipe = self.publish(author=User.objects.get(pk=self.author.pk))
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.feed_ids(), [recipe.pk])
+        self.client_for(self.readers[1]).delete(
+            f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(self.feed_ids(), [recipe.pk])
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.readers[0], recipe=recipe).exists())
+
+    def test_cursor_pages(self):
+        self.subscribe(self.readers[0])
+        recipes = [self.publish(f'Рецепт {i}') for i in range(5)]
+        expected = [recipe.pk for recipe in reversed(recipes)]
+        self.assertEqual(self.feed_ids(), expected)
+        found = []
+        url = '/api/users/feed/?paginate=cursor&limit=2'
+        while url:
+            response = self.reader_client.get(url)
+            found.extend(recipe['id'] for recipe in response.json()['results'])
+            url = response.json()['next']
+        self.assertEqual(found, expected)
+
+
+class AdminIngredientsTests(FoodgramTestCase):
+    '''Правка ингредиентов рецепта в админке доходит до списков
+    покупок.'''
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe(self.create_user('author'))
+        TagRecipe.objects.create(recipe=self.recipe, tag=self.tag)
+        IngredientAmount.objects.create(
+            recipe=self.recipe, ingredient=self.ingredient, amount=100)
+        self.sugar = Ingredient.objects.create(
+            name='Сахар', measurement_unit='г')
+        self.reader = self.create_user('reader')
+        response = self.client_for(self.reader).post(
+            f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        self.assertEqual(response.status_code, 201)
+        admin = self.create_user('admin')
+        admin.is_staff = admin.is_superuser = True
+        admin.save()
+        self.client.force_login(admin)
+        self.url = f'/admin/recipes/recipe/{self.recipe.pk}/change/'
+
+    def shopping_list(self):
+        return dict(ShoppingListItem.objects.filter(
+            user=self.reader
+        ).values_list('ingredient_id', 'amount'))
+
+    def post_change_form(self, rows):
+        '''Отправляет форму рецепта без изменений, кроме строк
+        ингредиентов rows: [(id строки или None, ингредиент, количество,
+        удалить ли)].'''
+        response = self.client.get(self.url)
+        form = response.context['adminform'].form
+        data = {}
+        for name in form.fields:
+            value = form[name].value()
+            if name == 'image' or value is None:
+                continue
+            data[name] = value
+        prefix = response.context['inline_admin_formsets'][0].formset.prefix
+        data.update({
+            f'{prefix}-TOTAL_FORMS': len(rows),
+            f'{prefix}-INITIAL_FORMS': sum(
+                row_id is not None for row_id, *_ in rows),
+            f'{prefix}-MIN_NUM_FORMS': 0,
+            f'{prefix}-MAX_NUM_FORMS': 1000,
+        })
+        for index, (row_id, ingredient, amount, delete) in enumerate(rows):
+            data.update({
+                f'{prefix}-{index}-id': row_id or '',
+                f'{prefix}-{index}-recipe': self.recipe.pk,
+                f'{prefix}-{index}-ingredient': ingredient.pk,
+                f'{prefix}-{index}-amount': amount,
+            })
+            if delete:
+                data[f'{prefix}-{index}-DELETE'] = 'on'
+        response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, 302)
+
+    def test_change_add_and_delete(self):
+        row = IngredientAmount.objects.get(recipe=self.recipe)
+        self.assertEqual(self.shopping_list(), {self.ingredient.pk: 100})
+        self.post_change_form([
+            (row.pk, self.ingredient, 150, False),
+            (None, self.sugar, 30, False),
+        ])
+        self.assertEqual(
+            self.shopping_list(),
+            {self.ingredient.pk: 150, self.sugar.pk: 30},
+        )
+        self.post_change_form([
+            (row.pk, self.ingredient, 150, True),
+            (IngredientAmount.objects.get(ingredient=self.sugar).pk,
+             self.sugar, 30, False),
+        ])
+        self.assertEqual(self.shopping_list(), {self.sugar.pk: 30})
+
+
+class UserRecipeBookkeepingTests(FoodgramTestCase):
+    '''Избранное и корзина учитываются один раз, как бы ни менялись.'''
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe(self.create_user('author'))
+        IngredientAmount.objects.create(
+            recipe=self.recipe, ingredient=self.ingredient, amount=100)
+        self.reader = self.create_user('reader')
+        self.reader_client = self.client_for(self.reader)
+
+    def favorites_count(self):
+        self.recipe.refresh_from_db()
+        return self.recipe.favorites_count
+
+    def shopping_list(self):
+        return dict(ShoppingListItem.objects.filter(
+            user=self.reader
+        ).values_list('ingredient_id', 'amount'))
+
+    def test_favorite(self):
+        url = f'/api/recipes/{self.recipe.pk}/favorite/'
+        self.reader_client.post(url)
+        self.assertEqual(self.favorites_count(), 1)
+        self.reader_client.delete(url)
+        self.assertEqual(self.favorites_count(), 0)
+        favorite = FavoriteRecipe.objects.create(
+            user=self.reader, recipe=self.recipe)
+        self.assertEqual(self.favorites_count(), 1)
+        favorite.delete()
+        self.assertEqual(self.favorites_count(), 0)
+
+    def test_shopping_cart(self):
+        url = f'/api/recipes/{self.recipe.pk}/shopping_cart/'
+        self.reader_client.post(url)
+        self.assertEqual(self.shopping_list(), {self.ingredient.pk: 100})
+        self.reader_client.delete(url)
+        self.assertEqual(self.shopping_list(), {})
+        ShoppingCart.objects.create(user=self.reader, recipe=self.recipe)
+        self.assertEqual(self.shopping_list(), {self.ingredient.pk: 100})
+        self.recipe.delete()
+        self.assertEqual(self.shopping_list(), {})
+
+    def test_drifted_shopping_list(self):
+        url = f'/api/recipes/{self.recipe.pk}/shopping_cart/'
+        self.reader_client.post(url)
+        ShoppingListItem.objects.filter(user=self.reader).update(amount=10)
+        with self.assertLogs('api.exceptions', 'ERROR'):
+            response = self.reader_client.delete(url)
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('rebuild_shopping_lists', response.json()['errors'])
+        self.assertTrue(ShoppingCart.objects.filter(
+            user=self.reader, recipe=self.recipe).exists())
+        self.assertEqual(self.shopping_list(), {self.ingredient.pk: 10})
+
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        self.assertEqual(self.reader_client.delete(url).status_code, 204)
+        self.assertEqual(self.shopping_list(), {})
+
+
+@override_settings(METRICS_ENABLED=True)
+class RequestMetricsTests(TransactionTestCase):
+    '''Server-Timing учитывает SQL и сериализацию и в синхронных, и в
+    асинхронных маршрутах.'''
+
+    def setUp(self):
+        cache.clear()
+        executor = mock.patch('recipes.images.executor')
+        executor.start()
+        self.addCleanup(executor.stop)
+        self.author = User.objects.create_user(
+            email='author@example.com',
+            username='author',
+            first_name='Имя',
+            last_name='Фамилия',
+            password=PASSWORD,
+        )
+        Recipe.objects.create(
+            author=self.author,
+            name='Блины',
+            text='Смешать и пожарить.',
+            cooking_time=20,
+            image='images/test.png',
+        )
+
+    def server_timing(self, response):
+        self.assertEqual(response.status_code, 200)
+        timing = dict(
+            part.strip().split(';', 1)
+            for part in response['Server-Timing'].split(',')
+        )
+        queries = int(timing['db'].split('desc="')[1].split()[0])
+        serializer = float(timing['serializer'].split('dur=')[1])
+        return queries, serializer
+
+    def test_sync_route(self):
+        queries, serializer = self.server_timing(
+            self.client.get('/api/recipes/'))
+        self.assertGreater(queries, 0)
+        self.assertGreater(serializer, 0)
+
+    async def test_async_route(self):
+        queries, serializer = self.server_timing(
+            await AsyncClient().get('/api/async/recipes/'))
+        self.assertGreater(queries, 0)
+        self.assertGreater(serializer, 0)
+
+    def test_serializer_outside_conditional_get(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        queries, serializer = self.server_timing(
+            client.get('/api/users/me/'))
+        self.assertGreater(serializer, 0)
+
+    async def test_async_routes_run_concurrently(self):
+        barrier = threading.Barrier(4, timeout=5)
+
+        def wait(viewset, request, *args, **kwargs):
+            barrier.wait()
+            return Response([])
+
+        with mock.patch.object(RecipeViewSet, 'list', wait):
+            responses = await asyncio.gather(*(
+                AsyncClient().get('/api/async/recipes/') for _ in range(4)
+            ))
+        self.assertEqual(
+            [response.status_code for response in responses], [200] * 4)
+
+
+class SeededEndpointsTests(APITestCase):
+    '''Эндпоинты на данных из api.management.seed.'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = seed(users=20, recipes_per_user=5, ingredients=500)
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = APIClient()
+        self.reader_client.credentials(
+            HTTP_AUTHORIZATION=(
+                f'Token {Token.objects.get(user=self.reader).key}'))
+
+    def test_query_budgets(self):
+        repeat = 2
+        anonymous = APIClient()
+        for group in get_cases(self.reader, self.reader_client, repeat):
+            for iteration in range(-1, repeat):
+                for case in group:
+                    _, queries = case.run(
+                        anonymous if case.anonymous else self.reader_client,
+                        max(iteration, 0),
+                    )
+                    with self.subTest(case.label, iteration=iteration):
+                        self.assertEqual(case.errors, [])
+                        # Первый проход прогревает кэши.
+                        if iteration >= 0:
+                            self.assertLessEqual(queries, case.queries)
+
+    def test_representation_matches_serializer(self):
+        '''Ответы API побайтно совпадают с выводом RecipeSerializer и
+        JSONRenderer.'''
+        total = Recipe.objects.count()
+        recipe_id = Recipe.objects.filter(author=self.reader).values_list(
+            'id', flat=True).first()
+        for user, client in ((AnonymousUser(), APIClient()),
+                             (self.reader, self.reader_client)):
+            for path, many in ((f'/api/recipes/?limit={total}', True),
+                               (f'/api/recipes/{recipe_id}/', False)):
+                request = Request(APIRequestFactory().get(path))
+                request.user = user
+                recipes = Recipe.objects.for_user(user).order_by(
+                    '-pub_date', '-id')
+                data = RecipeSerializer(
+                    recipes if many else recipes.get(pk=recipe_id),
+                    many=many,
+                    context={'request': request},
+                ).data
+                if many:
+                    data = {
+                        'count': total,
+                        'next': None,
+                        'previous': None,
+                        'results': data,
+                    }
+                with self.subTest(path, user=str(user)):
+                    self.assertEqual(
+                        client.get(path).content, JSONRenderer().render(data))
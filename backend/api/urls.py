@@ -1,6 +1,7 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from api import async_views
 from api.views import IngredientsViewSet, RecipeViewSet, TagViewSet
 from users.views import CustomUserViewSet
 
@@ -13,8 +14,25 @@ router.register('recipes', RecipeViewSet, basename='recipes')
 router.register('tags', TagViewSet, basename='tags')
 router.register('ingredients', IngredientsViewSet, basename='ingredients')
 
+async_urlpatterns = [
+    path('recipes/', async_views.recipe_list,
+         name='async-recipes-list'),
+    path('recipes/<pk>/', async_views.recipe_detail,
+         name='async-recipes-detail'),
+    path('tags/', async_views.tag_list,
+         name='async-tags-list'),
+    path('tags/<pk>/', async_views.tag_detail,
+         name='async-tags-detail'),
+    path('ingredients/', async_views.ingredient_list,
+         name='async-ingredients-list'),
+    path('ingredients/<pk>/', async_views.ingredient_detail,
+         name='async-ingredients-detail'),
+    path('users/subscriptions/', async_views.subscriptions,
+         name='async-users-subscriptions'),
+]
 
 urlpatterns = [
+    path('async/', include(async_urlpatterns)),
     path('auth/', include('djoser.urls.authtoken')),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
@@ -1,39 +1,87 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from rest_framework import (status, viewsets)
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.permissions import (IsAuthenticated,
+                                        IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 
-from api.filters import IngredientsFilter, RecipesFilter
+from api.cache import tag_cache
+from api.filters import RecipesFilter
+from api.mixins import ConditionalGetMixin
 from api.permissions import AuthorAndStaffOrReadOnlyPermission
+from api.renderers import SHOPPING_CART_RENDERERS
+from api.representations import RecipeRepresentation
+from api.search import ingredient_index
 from api.serializers import (FavoriteSerializer, IngredientSerializer,
-                             RecipeCreateSerializer, RecipeSerializer,
+                             RecipeCreateSerializer, RecipeIdsSerializer,
+                             RecipeSerializer,
                              SubscribeFavoriteRecipeSerializer,
                              TagSerializer)
-from recipes.models import (FavoriteRecipe, Ingredient, IngredientAmount,
-                            Recipe, ShoppingCart, Tag)
-from users.pagination import CustomPagination
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag)
+from users.pagination import (CursorPaginationMixin, CustomPagination,
+                              RecipeCursorPagination)
+
+SHOPPING_CART_CHUNK_SIZE = 500
 
 
 class TagViewSet(viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
+    read_from_replica = True
+
+    def list(self, request, *args, **kwargs):
+        return Response(tag_cache.rows())
 
+    def retrieve(self, request, *args, **kwargs):
+        for tag in tag_cache.rows():
+            if str(tag['id']) == kwargs['pk']:
+                return Response(tag)
+        raise Http404
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(ConditionalGetMixin, CursorPaginationMixin,
+                    viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,
                           AuthorAndStaffOrReadOnlyPermission,)
+    read_from_replica = True
     filterset_class = RecipesFilter
     pagination_class = CustomPagination
+    cursor_pagination_classes = {'list': RecipeCursorPagination}
+    version_fields = (
+        'id',
+        'updated_at',
+        'is_favorited',
+        'is_in_shopping_cart',
+        'is_subscribed',
+    )
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        queryset = queryset.order_by('-pub_date')
-        return queryset
+        '''list и retrieve читают get_version_queryset и represent.'''
+        return super().get_queryset().order_by('-pub_date', '-id')
+
+    def get_version_queryset(self):
+        return Recipe.objects.versions(
+            self.request.user
+        ).order_by('-pub_date', '-id')
+
+    def get_shared_versions(self):
+        '''Теги рецептов берутся из кэша справочника.'''
+        return (tag_cache.version(),)
+
+    def represent(self, pks):
+        return RecipeRepresentation(self.request).many(pks)
+
+    def get_last_modified(self, versions):
+        '''Флаги пользователя в updated_at не отражаются, поэтому
+        Last-Modified отдаётся только анонимам и только для рецепта.'''
+        if self.detail and self.request.user.is_anonymous:
+            return versions[0].updated_at
+        return None
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -41,40 +89,36 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return RecipeCreateSerializer
 
     def favorite_shopping_cart_creator(self, model, request, pk):
-        recipe = Recipe.objects.get(id=pk)
-        user = request.user
-        objects_exists = model.objects.filter(
-            user=user,
-            recipe=recipe
-        ).exists()
+        recipe = get_object_or_404(Recipe, id=pk)
 
         if request.method == 'POST':
-
-            if objects_exists:
+            if not model.objects.add(request.user, [recipe.id]):
                 return Response(
                     {'errors': 'Данный рецепт уже добавлен'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-
-            model.objects.create(
-                user=user,
-                recipe=recipe
-            )
             serializer = SubscribeFavoriteRecipeSerializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        if not objects_exists:
+        if not model.objects.remove(request.user, [recipe.id]):
             return Response(
                 {'errors': 'Данного рецепта нет в списке'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-
-        model.objects.filter(
-            user=user,
-            recipe=recipe
-        ).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def favorite_shopping_cart_batch(self, model, request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+
+        if request.method == 'POST':
+            added = model.objects.add(request.user, recipe_ids)
+            return Response({'added': added}, status=status.HTTP_201_CREATED)
+
+        removed = model.objects.remove(request.user, recipe_ids)
+        return Response({'removed': removed}, status=status.HTTP_200_OK)
+
     @action(
         detail=True,
         methods=('POST', 'DELETE'),
@@ -83,6 +127,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return self.favorite_shopping_cart_creator(FavoriteRecipe, request,
                                                    pk)
 
+    @action(
+        detail=False,
+        methods=('POST', 'DELETE'),
+        url_path='favorite',
+    )
+    def favorite_batch(self, request):
+        return self.favorite_shopping_cart_batch(FavoriteRecipe, request)
+
     @action(detail=False, methods=('GET',))
     def favorites(self, request):
         user = request.user
@@ -99,29 +151,56 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @action(
         detail=False,
-        methods=('GET',)
+        methods=('POST', 'DELETE'),
+        url_path='shopping_cart',
+    )
+    def shopping_cart_batch(self, request):
+        return self.favorite_shopping_cart_batch(ShoppingCart, request)
+
+    @action(
+        detail=False,
+        methods=('GET',),
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=SHOPPING_CART_RENDERERS,
     )
     def download_shopping_cart(self, request):
-        user = request.user
-        recipe_ids = ShoppingCart.objects.filter(
-            user=user).values_list('recipe_id', flat=True)
-        ingredients = IngredientAmount.objects.filter(
-            recipe_id__in=recipe_ids
+        renderer = request.accepted_renderer
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user
         ).values_list(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(total_quantity=Sum('amount'))
-        shopping_cart = 'Список покупок:\n'
-        for item in ingredients:
-            name, measurement_unit, total_quantity = item
-            shopping_cart += f'{name} - {total_quantity} {measurement_unit}\n'
-        response = HttpResponse(shopping_cart, content_type='text/plain')
+            'ingredient_id',
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            'amount',
+        ).order_by('ingredient__name')
+        response = StreamingHttpResponse(
+            renderer.stream(
+                ingredients.iterator(chunk_size=SHOPPING_CART_CHUNK_SIZE)
+            ),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
         response['Content-Disposition'] = (
-            'attachment; filename=shopping_cart.txt')
+            f'attachment; filename=shopping_cart.{renderer.format}')
         return response
 
 
 class IngredientsViewSet(viewsets.ModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filterset_class = IngredientsFilter
     permission_classes = (IsAuthenticatedOrReadOnly,)
+    read_from_replica = True
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_index.search(name))
+        return Response(ingredient_index.all())
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            ingredient = ingredient_index.get(int(kwargs['pk']))
+        except ValueError:
+            ingredient = None
+        if ingredient is None:
+            raise Http404
+        return Response(ingredient)
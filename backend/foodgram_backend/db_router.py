@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import random
+
+from asgiref.local import Local
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework.permissions import SAFE_METHODS
+
+_state = Local()
+
+PRIMARY = 'default'
+PIN_KEY_PREFIX = 'replica-pin:'
+# Токен проверяется до того, как пользователь успевает что-то записать,
+# и только что выданный токен может ещё не доехать до реплики.
+PRIMARY_APP_LABELS = {'authtoken'}
+
+
+def pin_key(request):
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if not authorization:
+        return None
+    return PIN_KEY_PREFIX + hashlib.sha256(
+        authorization.encode()).hexdigest()
+
+
+class ReplicaRouter:
+    '''Чтение в запросах, помеченных ReplicaRoutingMiddleware, уходит на
+    выбранную для запроса реплику, всё остальное на основную базу.'''
+
+    def db_for_read(self, model, **hints):
+        replica = getattr(_state, 'replica', None)
+        if replica and model._meta.app_label not in PRIMARY_APP_LABELS:
+            return replica
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+class ReplicaRoutingMiddleware:
+    '''Отправляет безопасные запросы к вьюсетам с read_from_replica = True
+    на случайную реплику из DB_REPLICAS, одну на весь запрос.
+
+    После записи клиент на DB_REPLICA_PIN_SECONDS закрепляется за основной
+    базой, чтобы сразу увидеть свои изменения несмотря на задержку
+    репликации. Клиент определяется по заголовку Authorization. Отметка
+    хранится в кэше, и при нескольких воркерах кэш должен быть общим.
+    Без DB_REPLICAS не подключается.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DB_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Так Django 3.2 узнаёт асинхронное middleware, как
+            # в MiddlewareMixin: запросы не проходят через единственный
+            # поток синхронного кода.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.replica = None
+        self.pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.replica = None
+        self.pin(request, response)
+        return response
+
+    def pin(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            key = pin_key(request)
+            if key:
+                cache.set(key, True, settings.DB_REPLICA_PIN_SECONDS)
+
+    def choose_replica(self, request, view_func):
+        view_class = getattr(view_func, 'cls', None)
+        if (request.method not in SAFE_METHODS
+                or not getattr(view_class, 'read_from_replica', False)):
+            return
+        key = pin_key(request)
+        if key is None or not cache.get(key):
+            _state.replica = random.choice(settings.DB_REPLICAS)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.choose_replica(request, view_func)
+
+    async def aprocess_view(self, request, view_func, view_args,
+                            view_kwargs):
+        self.choose_replica(request, view_func)
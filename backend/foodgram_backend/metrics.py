@@ -0,0 +1,241 @@
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+from asgiref.local import Local
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+
+# Local из asgiref, а не threading.local: значения видны и в потоках
+# sync_to_async, где под ASGI выполняются асинхронные маршруты.
+_local = Local()
+
+
+class Histogram:
+    '''Гистограмма длительностей в секундах для одного маршрута.'''
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        '''Накопительные значения бакетов, как того требует Prometheus.'''
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield str(bound), total
+        yield '+Inf', total + self.counts[-1]
+
+
+class Registry:
+    '''Метрики запросов процесса.
+
+    Хранятся в памяти воркера: при нескольких воркерах gunicorn каждый
+    отдаёт на /metrics/ свои значения.
+    '''
+    histograms = (
+        ('request_duration_seconds', 'Полное время обработки запроса'),
+        ('sql_duration_seconds', 'Время SQL-запросов за запрос'),
+        ('serializer_duration_seconds', 'Время сериализации за запрос'),
+    )
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.collectors = []
+        self.reset()
+
+    def register(self, collector):
+        '''Подключает функцию, которая возвращает строки метрик других
+        модулей в формате Prometheus.'''
+        self.collectors.append(collector)
+        return collector
+
+    def reset(self):
+        with self.lock:
+            self.durations = {
+                name: defaultdict(lambda: Histogram(self.buckets))
+                for name, _ in self.histograms
+            }
+            self.queries = defaultdict(int)
+
+    def observe(self, labels, timings):
+        with self.lock:
+            self.durations['request_duration_seconds'][labels].observe(
+                timings['total'])
+            self.durations['sql_duration_seconds'][labels].observe(
+                timings['sql'])
+            self.durations['serializer_duration_seconds'][labels].observe(
+                timings['serializer'])
+            self.queries[labels] += timings['queries']
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for key, description in self.histograms:
+                name = f'foodgram_{key}'
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in sorted(self.durations[key].items()):
+                    label = format_labels(labels)
+                    for bound, count in histogram.samples():
+                        lines.append(
+                            f'{name}_bucket{{{label},le="{bound}"}} {count}')
+                    lines.append(f'{name}_sum{{{label}}} {histogram.sum}')
+                    lines.append(
+                        f'{name}_count{{{label}}} {sum(histogram.counts)}')
+            name = 'foodgram_sql_queries_total'
+            lines.append(f'# HELP {name} Число SQL-запросов')
+            lines.append(f'# TYPE {name} counter')
+            for labels, count in sorted(self.queries.items()):
+                lines.append(f'{name}{{{format_labels(labels)}}} {count}')
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    route, method = labels
+    return f'route="{route}",method="{method}"'
+
+
+registry = Registry(tuple(settings.METRICS_BUCKETS))
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings['sql'] += time.perf_counter() - started
+        timings['queries'] += 1
+
+
+def install_sql_wrapper(connection, **kwargs):
+    '''Подключает учёт SQL к соединению. У каждого потока свои
+    соединения, поэтому обёртка ставится при их создании, а не на время
+    запроса в потоке middleware.'''
+    if sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_wrapper)
+
+
+@contextmanager
+def timed_serialization():
+    '''Добавляет время блока к времени сериализации текущего запроса.
+    Вложенные блоки отдельно не учитываются.'''
+    timings = getattr(_local, 'timings', None)
+    if timings is None or timings['serializing']:
+        yield
+        return
+    timings['serializing'] = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings['serializer'] += time.perf_counter() - started
+        timings['serializing'] = False
+
+
+class TimedRepresentationMixin:
+    '''Учитывает to_representation сериализатора как время сериализации.
+
+    Подмешивается ко всем сериализаторам проекта. Для вложенных
+    сериализаторов и many=True время считается один раз, на верхнем
+    уровне.
+    '''
+
+    def to_representation(self, instance):
+        with timed_serialization():
+            return super().to_representation(instance)
+
+
+class RequestMetricsMiddleware:
+    '''Время запроса, SQL и сериализации по маршрутам.
+
+    Отдаёт заголовок Server-Timing и копит гистограммы для /metrics/.
+    Сериализацией считается to_representation сериализаторов
+    (TimedRepresentationMixin) и сборка ответа в RecipeRepresentation.
+    Работает и в синхронном, и в асинхронном режиме, поэтому под ASGI не
+    выстраивает асинхронные маршруты в очередь. При
+    METRICS_ENABLED = False не подключается вовсе.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        connection_created.connect(
+            install_sql_wrapper, dispatch_uid='request_metrics_sql')
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Так Django 3.2 узнаёт асинхронное middleware, как
+            # в MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timings, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _local.timings = None
+        return self.finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        timings, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _local.timings = None
+        return self.finish(request, response, timings, started)
+
+    def start(self):
+        for connection in connections.all():
+            install_sql_wrapper(connection)
+        _local.timings = timings = {
+            'queries': 0,
+            'sql': 0.0,
+            'serializer': 0.0,
+            'serializing': False,
+        }
+        return timings, time.perf_counter()
+
+    def finish(self, request, response, timings, started):
+        timings['total'] = time.perf_counter() - started
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={timings["sql"] * 1000:.1f};'
+            f'desc="{timings["queries"]} queries"',
+            f'serializer;dur={timings["serializer"] * 1000:.1f}',
+            f'total;dur={timings["total"] * 1000:.1f}',
+        ))
+        match = request.resolver_match
+        if match is None or match.url_name != 'metrics':
+            route = match.url_name if match and match.url_name else (
+                'unmatched')
+            registry.observe((route, request.method), timings)
+        return response
+
+
+def metrics_view(request):
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(
+        registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
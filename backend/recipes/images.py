@@ -0,0 +1,139 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = 'images/derivatives/'
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+    thread_name_prefix='image-derivatives',
+)
+
+
+def derivative_names(image_name):
+    '''Имена уменьшенной копии и WebP-версии для исходного файла.'''
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return (
+        f'{DERIVATIVES_DIR}{stem}-thumbnail.webp',
+        f'{DERIVATIVES_DIR}{stem}.webp',
+    )
+
+
+def encode_webp(image):
+    buffer = BytesIO()
+    image.save(buffer, 'WEBP', quality=settings.IMAGE_WEBP_QUALITY)
+    return ContentFile(buffer.getvalue())
+
+
+def save_derivative(storage, name, content):
+    if storage.exists(name):
+        storage.delete(name)
+    return storage.save(name, content)
+
+
+def delete_unused_derivatives(storage, names):
+    '''Удаляет файлы производных, на которые не ссылается ни один рецепт.
+
+    nginx отдаёт производные с immutable, поэтому при смене фото у них
+    новые имена, а старые файлы удаляются здесь. Одно фото может быть
+    у нескольких рецептов, и общие производные остаются, пока нужны.
+    '''
+    from recipes.models import Recipe
+
+    names = {name for name in names if name}
+    if not names:
+        return
+    used = set()
+    for thumbnail_name, webp_name in Recipe.objects.filter(
+        Q(image_thumbnail__in=names) | Q(image_webp__in=names)
+    ).values_list('image_thumbnail', 'image_webp'):
+        used.update((thumbnail_name, webp_name))
+    for name in names - used:
+        storage.delete(name)
+
+
+def build_derivatives(recipe_id):
+    '''Строит производные фото рецепта и удаляет прежние.
+
+    Возвращает False, если рецепт удалён или фото не удалось прочитать.
+    Ошибки базы не перехватываются.
+    '''
+    from recipes.models import Recipe
+
+    recipe = Recipe.objects.only(
+        'image', 'image_thumbnail', 'image_webp'
+    ).filter(pk=recipe_id).first()
+    if recipe is None:
+        return False
+    try:
+        storage = recipe.image.storage
+        with recipe.image.open('rb') as file:
+            image = ImageOps.exif_transpose(Image.open(file))
+            image = image.convert('RGBA' if 'A' in image.getbands()
+                                  else 'RGB')
+        thumbnail_name, webp_name = derivative_names(recipe.image.name)
+        webp_name = save_derivative(storage, webp_name, encode_webp(image))
+        image.thumbnail(settings.RECIPE_THUMBNAIL_SIZE)
+        thumbnail_name = save_derivative(
+            storage, thumbnail_name, encode_webp(image))
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.exception('Не удалось обработать фото рецепта %s', recipe_id)
+        return False
+    built = {thumbnail_name, webp_name}
+    if Recipe.objects.filter(
+        pk=recipe_id,
+        image=recipe.image.name,
+    ).update(
+        image_thumbnail=thumbnail_name,
+        image_webp=webp_name,
+        updated_at=timezone.now(),
+    ):
+        stale = {recipe.image_thumbnail.name, recipe.image_webp.name} - built
+    else:
+        # Фото сменилось, пока строились производные: они не нужны.
+        stale = built
+    delete_unused_derivatives(storage, stale)
+    return True
+
+
+def build_derivatives_in_pool(recipe_id):
+    '''Задача пула: у его потока своё соединение с базой, и закрыть его
+    можно только здесь.'''
+    try:
+        build_derivatives(recipe_id)
+    except Exception:
+        logger.exception('Не удалось обработать фото рецепта %s', recipe_id)
+    finally:
+        connection.close()
+
+
+def schedule_derivatives(recipe):
+    '''Ставит построение производных в пул после коммита транзакции.'''
+    recipe_id = recipe.pk
+    transaction.on_commit(
+        lambda: executor.submit(build_derivatives_in_pool, recipe_id))
+
+
+def delete_derivatives(recipe):
+    '''Удаляет производные удалённого рецепта после коммита.'''
+    storage = recipe.image_thumbnail.storage
+    names = (recipe.image_thumbnail.name, recipe.image_webp.name)
+    transaction.on_commit(lambda: delete_unused_derivatives(storage, names))
+
+
+def derivatives_outdated(recipe):
+    if not recipe.image:
+        return False
+    thumbnail_name, webp_name = derivative_names(recipe.image.name)
+    return (recipe.image_thumbnail.name != thumbnail_name
+            or recipe.image_webp.name != webp_name)
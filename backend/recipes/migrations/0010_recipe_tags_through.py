@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+
+def copy_recipe_tags(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    TagRecipe = apps.get_model('recipes', 'TagRecipe')
+    TagRecipe.objects.bulk_create(
+        [
+            TagRecipe(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id, tag_id in Recipe.tags.through.objects.values_list(
+                'recipe_id', 'tag_id')
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_recipe_tags, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RemoveField(
+                    model_name='recipe',
+                    name='tags',
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='recipe',
+                    name='tags',
+                    field=models.ManyToManyField(help_text='Выберите тэги', through='recipes.TagRecipe', to='recipes.Tag', verbose_name='Тэги'),
+                ),
+            ],
+        ),
+    ]
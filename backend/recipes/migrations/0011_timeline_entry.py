@@ -0,0 +1,78 @@
+# Generated by Django 3.2.3 on 2026-10-18 19:03
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_timelines(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    UserSubscribe = apps.get_model('users', 'UserSubscribe')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    TimelineEntry = apps.get_model('recipes', 'TimelineEntry')
+    User.objects.update(subscribers_count=Coalesce(
+        Subquery(
+            UserSubscribe.objects.filter(
+                target_user=OuterRef('pk')
+            ).values('target_user').annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        0,
+    ))
+    authors = User.objects.filter(
+        subscribers_count__gt=0,
+        subscribers_count__lt=settings.FEED_FANOUT_LIMIT,
+    ).values_list('pk', flat=True)
+    for author_id in authors.iterator():
+        recipes = list(Recipe.objects.filter(author_id=author_id).order_by(
+            '-pub_date', '-id'
+        ).values_list('id', 'pub_date')[:settings.FEED_BACKFILL_SIZE])
+        subscribers = UserSubscribe.objects.filter(
+            target_user_id=author_id
+        ).values_list('subscriber_id', flat=True)
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(
+                    user_id=subscriber_id,
+                    recipe_id=recipe_id,
+                    pub_date=pub_date,
+                )
+                for subscriber_id in subscribers.iterator()
+                for recipe_id, pub_date in recipes
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0010_recipe_tags_through'),
+        ('users', '0003_user_subscribers_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='timeline_user_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_timeline_entry'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
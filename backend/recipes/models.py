@@ -1,7 +1,13 @@
-from django.db import models
+from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import ValidationError
+from django.db import (IntegrityError, connections, models, router,
+                       transaction)
+from django.db.models import (Case, Exists, F, OuterRef, Prefetch, Q, Sum,
+                              When)
 
 from api.validators import color_validator
-from users.models import User
+from users.models import CounterFieldsMixin, User, UserSubscribe
 
 
 class Ingredient(models.Model):
@@ -22,10 +28,38 @@ class Ingredient(models.Model):
         null=False,
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
+
     def __str__(self):
         return self.name
 
 
+# Биты 0..62: маска рецепта хранится в BigIntegerField и остаётся
+# положительной.
+TAG_BITS = 63
+
+
+class TagQuerySet(models.QuerySet):
+
+    def free_bits(self):
+        '''Незанятые биты маски тегов по возрастанию.'''
+        used = set(self.values_list('bit', flat=True))
+        return [bit for bit in range(TAG_BITS) if bit not in used]
+
+    def mask(self, ids):
+        '''Маска тегов с данными id.'''
+        mask = 0
+        for bit in self.filter(id__in=ids).values_list('bit', flat=True):
+            mask |= 1 << bit
+        return mask
+
+
 class Tag(models.Model):
     name = models.CharField(
         max_length=256,
@@ -50,12 +84,139 @@ class Tag(models.Model):
         null=False,
         unique=True,
     )
+    bit = models.PositiveSmallIntegerField(
+        verbose_name='Бит в маске тегов',
+        unique=True,
+        editable=False,
+    )
+
+    objects = TagQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    def clean(self):
+        if self.bit is None and not Tag.objects.free_bits():
+            raise ValidationError(
+                f'Тегов не может быть больше {TAG_BITS}')
+
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+
+    def for_user(self, user):
+        '''Связанные объекты и флаги пользователя для списка рецептов
+        загружаются фиксированным числом запросов.'''
+        queryset = self.prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.order_by('id')),
+            Prefetch(
+                'ingredientamount_set',
+                queryset=IngredientAmount.objects.select_related(
+                    'ingredient'
+                ).order_by('id')
+            ),
+        )
+        if user.is_anonymous:
+            return queryset.select_related('author')
+
+        authors = User.objects.annotate(is_subscribed=Exists(
+            UserSubscribe.objects.filter(
+                subscriber=user,
+                target_user=OuterRef('pk'),
+            )
+        ))
+        return queryset.prefetch_related(
+            Prefetch('author', queryset=authors)
+        ).annotate(
+            is_favorited=Exists(FavoriteRecipe.objects.filter(
+                user=user,
+                recipe=OuterRef('pk'),
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user,
+                recipe=OuterRef('pk'),
+            )),
+        )
+
+    def versions(self, user):
+        '''Только поля, от которых зависит представление рецепта для
+        пользователя: по ним строится ETag без загрузки связанных
+        объектов.'''
+        queryset = self.only('id', 'pub_date', 'updated_at')
+        if user.is_anonymous:
+            return queryset
+        return queryset.annotate(
+            is_favorited=Exists(FavoriteRecipe.objects.filter(
+                user=user,
+                recipe=OuterRef('pk'),
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user,
+                recipe=OuterRef('pk'),
+            )),
+            is_subscribed=Exists(UserSubscribe.objects.filter(
+                subscriber=user,
+                target_user=OuterRef('author'),
+            )),
+        )
+
+    def with_tags(self, mask, match_all=False):
+        '''Рецепты с любым или со всеми тегами маски.
+
+        Условие проверяется по tags_mask самого рецепта: без JOIN с тегами
+        и без DISTINCT, сколько бы тегов ни было выбрано.
+        '''
+        queryset = self.alias(tags_match=F('tags_mask').bitand(mask))
+        if match_all:
+            return queryset.filter(tags_match=mask)
+        return queryset.filter(tags_match__gt=0)
+
+    def refresh_tags_mask(self):
+        '''Пересчитывает tags_mask рецептов по их тегам.'''
+        masks = dict.fromkeys(self.values_list('id', flat=True), 0)
+        for recipe_id, bit in TagRecipe.objects.filter(
+            recipe_id__in=masks
+        ).values_list('recipe_id', 'tag__bit'):
+            masks[recipe_id] |= 1 << bit
+        self.model.objects.bulk_update(
+            [
+                self.model(id=recipe_id, tags_mask=mask)
+                for recipe_id, mask in masks.items()
+            ],
+            ['tags_mask'],
+            batch_size=1000,
+        )
+
+    def feed(self, user):
+        '''Рецепты авторов, на которых подписан пользователь.
+
+        Рецепты обычных авторов разносятся по лентам подписчиков при
+        публикации, и лента читается одним проходом по индексу
+        TimelineEntry. Рецепты популярных авторов в ленты не разносятся
+        и добавляются при чтении. Порядок задают аннотации feed_pub_date и
+        feed_recipe_id, по ним же идёт курсорная пагинация.
+        '''
+        popular_authors = list(UserSubscribe.objects.filter(
+            subscriber=user,
+            target_user__subscribers_count__gte=settings.FEED_FANOUT_LIMIT,
+        ).values_list('target_user_id', flat=True))
+        if not popular_authors:
+            queryset = self.filter(timeline_entries__user=user).annotate(
+                feed_pub_date=F('timeline_entries__pub_date'),
+                feed_recipe_id=F('timeline_entries__recipe_id'),
+            )
+        else:
+            queryset = self.filter(
+                Q(id__in=TimelineEntry.objects.filter(
+                    user=user).values('recipe_id'))
+                | Q(author_id__in=popular_authors)
+            ).annotate(
+                feed_pub_date=F('pub_date'),
+                feed_recipe_id=F('id'),
+            )
+        return queryset.order_by('-feed_pub_date', '-feed_recipe_id')
+
+
+class Recipe(CounterFieldsMixin, models.Model):
     author = models.ForeignKey(
         User,
         verbose_name='Автор рецепта',
@@ -79,6 +240,18 @@ class Recipe(models.Model):
         blank=False,
         null=False,
     )
+    image_thumbnail = models.ImageField(
+        verbose_name='Уменьшенная копия фото',
+        upload_to='images/derivatives/',
+        blank=True,
+        editable=False,
+    )
+    image_webp = models.ImageField(
+        verbose_name='Фото в формате WebP',
+        upload_to='images/derivatives/',
+        blank=True,
+        editable=False,
+    )
     text = models.TextField(
         verbose_name='Рецепт приготовления',
         help_text='Напишите рецепт приготовления блюда',
@@ -97,6 +270,7 @@ class Recipe(models.Model):
         Tag,
         verbose_name='Тэги',
         help_text='Выберите тэги',
+        through='TagRecipe',
         blank=False,
         null=False,
     )
@@ -110,6 +284,30 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Число добавлений в избранное',
+        default=0,
+        editable=False,
+    )
+    tags_mask = models.BigIntegerField(
+        verbose_name='Маска тегов',
+        help_text='Биты Tag.bit всех тегов рецепта',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
+    counter_fields = ('favorites_count',)
 
     class Meta:
         constraints = [
@@ -118,13 +316,18 @@ class Recipe(models.Model):
                 name='unique_recipe'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
     def get_favorite_count(self):
-        favorite_count = FavoriteRecipe.objects.filter(recipe=self).count()
-        return favorite_count
+        return self.favorites_count
     get_favorite_count.short_description = 'Число добавлений в избранное'
 
 
@@ -184,6 +387,96 @@ class TagRecipe(models.Model):
         ]
 
 
+class UserRecipeQuerySet(models.QuerySet):
+    '''Пакетное добавление и удаление рецептов из списков пользователя.
+
+    Вставка идёт через INSERT ... ON CONFLICT DO NOTHING, удаление - одним
+    DELETE; оба возвращают id затронутых рецептов, поэтому повторные и
+    одновременные запросы не приводят к ошибкам и двойному учёту.
+    '''
+
+    def _execute(self, sql, params):
+        db = router.db_for_write(self.model)
+        with connections[db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def _names(self):
+        opts = self.model._meta
+        quote = connections[router.db_for_write(self.model)].ops.quote_name
+        return (
+            quote(opts.db_table),
+            quote(opts.get_field('user').column),
+            quote(opts.get_field('recipe').column),
+            quote(Recipe._meta.db_table),
+        )
+
+    def add(self, user, recipe_ids):
+        recipe_ids = sorted(set(recipe_ids))
+        if not recipe_ids:
+            return []
+        table, user_column, recipe_column, recipe_table = self._names()
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            added = self._execute(
+                f'INSERT INTO {table} ({user_column}, {recipe_column}) '
+                f'SELECT %s, id FROM {recipe_table} '
+                f'WHERE id IN ({placeholders}) '
+                f'ON CONFLICT ({user_column}, {recipe_column}) DO NOTHING '
+                f'RETURNING {recipe_column}',
+                [user.pk, *recipe_ids],
+            )
+            if added:
+                self.recipes_added(user.pk, added)
+        return added
+
+    def remove(self, user, recipe_ids):
+        recipe_ids = sorted(set(recipe_ids))
+        if not recipe_ids:
+            return []
+        table, user_column, recipe_column, _ = self._names()
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            removed = self._execute(
+                f'DELETE FROM {table} WHERE {user_column} = %s '
+                f'AND {recipe_column} IN ({placeholders}) '
+                f'RETURNING {recipe_column}',
+                [user.pk, *recipe_ids],
+            )
+            if removed:
+                self.recipes_removed(user.pk, removed)
+        return removed
+
+    def recipes_added(self, user_id, recipe_ids):
+        '''Учёт добавления: единственное место, где он делается. Вызывается
+        из add() и из сигналов при сохранении отдельных объектов.'''
+
+    def recipes_removed(self, user_id, recipe_ids):
+        '''Учёт удаления, вызывается из remove() и из сигналов.'''
+
+
+class FavoriteRecipeQuerySet(UserRecipeQuerySet):
+
+    def recipes_added(self, user_id, recipe_ids):
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            favorites_count=F('favorites_count') + 1)
+
+    def recipes_removed(self, user_id, recipe_ids):
+        Recipe.objects.filter(
+            pk__in=recipe_ids,
+            favorites_count__gt=0,
+        ).update(favorites_count=F('favorites_count') - 1)
+
+
+class ShoppingCartQuerySet(UserRecipeQuerySet):
+
+    def recipes_added(self, user_id, recipe_ids):
+        ShoppingListItem.objects.add_recipes(user_id, recipe_ids)
+
+    def recipes_removed(self, user_id, recipe_ids):
+        ShoppingListItem.objects.remove_recipes(user_id, recipe_ids)
+
+
 class FavoriteRecipe(models.Model):
     user = models.ForeignKey(
         User,
@@ -196,6 +489,8 @@ class FavoriteRecipe(models.Model):
         on_delete=models.CASCADE,
     )
 
+    objects = FavoriteRecipeQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -218,6 +513,8 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
     )
 
+    objects = ShoppingCartQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -229,3 +526,215 @@ class ShoppingCart(models.Model):
     def __str__(self):
         return (f'рецепт {self.recipe} в списке покупок '
                 f'пользователя {self.user}')
+
+
+class ShoppingListOutOfSync(Exception):
+    '''Сумма в списке покупок ушла бы в минус: списки разошлись
+    с корзинами.'''
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+
+    def change_amounts(self, user_ids, deltas):
+        '''Изменяет суммы ингредиентов в списках покупок пользователей.
+
+        deltas - словарь {id ингредиента: изменение количества}. Суммы не
+        обрезаются нулём: если списки разошлись с корзинами, уход в минус
+        нарушает ограничение поля, изменения откатываются и выбрасывается
+        ShoppingListOutOfSync. Списки тогда нужно пересобрать командой
+        rebuild_shopping_lists.
+        '''
+        user_ids = list(user_ids)
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta
+        }
+        if not user_ids or not deltas:
+            return
+        try:
+            with transaction.atomic(using=self.db):
+                self._change_amounts(user_ids, deltas)
+        except IntegrityError as error:
+            raise ShoppingListOutOfSync(
+                'Списки покупок разошлись с корзинами. Администратору нужно '
+                'выполнить manage.py rebuild_shopping_lists.'
+            ) from error
+
+    def _change_amounts(self, user_ids, deltas):
+        self.bulk_create(
+            [
+                ShoppingListItem(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    amount=0,
+                )
+                for user_id in user_ids
+                for ingredient_id, delta in deltas.items() if delta > 0
+            ],
+            ignore_conflicts=True,
+        )
+        items = self.filter(user_id__in=user_ids, ingredient_id__in=deltas)
+        items.update(amount=Case(
+            *(When(ingredient_id=ingredient_id, then=F('amount') + delta)
+              for ingredient_id, delta in deltas.items()),
+            default=F('amount'),
+        ))
+        items.filter(amount=0).delete()
+
+    def change_recipe(self, recipe_id, deltas):
+        '''Переносит изменения количеств ингредиентов рецепта в списки
+        покупок всех, у кого он в корзине.'''
+        self.change_amounts(
+            ShoppingCart.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('user_id', flat=True),
+            deltas,
+        )
+
+    def add_recipes(self, user_id, recipe_ids, sign=1):
+        deltas = IngredientAmount.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values('ingredient_id').annotate(total=Sum('amount'))
+        self.change_amounts(
+            [user_id],
+            {row['ingredient_id']: sign * row['total'] for row in deltas}
+        )
+
+    def remove_recipes(self, user_id, recipe_ids):
+        self.add_recipes(user_id, recipe_ids, sign=-1)
+
+    def expected(self):
+        '''Суммы ингредиентов, посчитанные заново по спискам покупок.'''
+        rows = ShoppingCart.objects.filter(
+            recipe__ingredientamount__isnull=False
+        ).values(
+            'user_id',
+            ingredient_id=F('recipe__ingredientamount__ingredient_id'),
+        ).annotate(total=Sum('recipe__ingredientamount__amount'))
+        return {
+            (row['user_id'], row['ingredient_id']): row['total']
+            for row in rows
+        }
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество',
+    )
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.amount} для {self.user}'
+
+
+class TimelineEntryQuerySet(models.QuerySet):
+
+    def fans_out(self, author_id):
+        '''Разносятся ли рецепты автора по лентам. Счётчик подписчиков
+        читается из базы: объект автора у вызывающего может быть
+        прочитан до подписки.'''
+        return User.objects.filter(
+            pk=author_id,
+            subscribers_count__lt=settings.FEED_FANOUT_LIMIT,
+        ).exists()
+
+    def fan_out(self, recipe):
+        '''Добавляет рецепт в ленты подписчиков автора.'''
+        if not self.fans_out(recipe.author_id):
+            return
+        subscribers = UserSubscribe.objects.filter(
+            target_user=recipe.author_id
+        ).values_list('subscriber_id', flat=True)
+        self.bulk_create(
+            [
+                TimelineEntry(
+                    user_id=subscriber_id,
+                    recipe_id=recipe.pk,
+                    pub_date=recipe.pub_date,
+                )
+                for subscriber_id in subscribers.iterator()
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    def backfill(self, author_id, user_ids):
+        '''Добавляет в ленты user_ids последние рецепты автора.'''
+        if not self.fans_out(author_id):
+            return
+        recipes = list(Recipe.objects.filter(author_id=author_id).order_by(
+            '-pub_date', '-id'
+        ).values_list('id', 'pub_date')[:settings.FEED_BACKFILL_SIZE])
+        self.bulk_create(
+            (
+                TimelineEntry(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    pub_date=pub_date,
+                )
+                for user_id in user_ids
+                for recipe_id, pub_date in recipes
+            ),
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    def prune(self, user_id, author_id):
+        self.filter(user_id=user_id, recipe__author_id=author_id).delete()
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        verbose_name='Подписчик',
+        on_delete=models.CASCADE,
+        related_name='timeline',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Рецепт',
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    objects = TimelineEntryQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='timeline_user_pub_date_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
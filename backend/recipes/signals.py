@@ -0,0 +1,131 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from recipes.images import (delete_derivatives, derivatives_outdated,
+                            schedule_derivatives)
+from recipes.models import (TAG_BITS, FavoriteRecipe, Ingredient, Recipe,
+                            ShoppingCart, Tag, TimelineEntry)
+from users.models import User, UserSubscribe
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingCart)
+def user_recipe_added(sender, instance, created, **kwargs):
+    '''Объекты, сохранённые мимо add(), например в админке.'''
+    if created:
+        sender.objects.recipes_added(instance.user_id, [instance.recipe_id])
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(pre_delete, sender=ShoppingCart)
+def user_recipe_removed(sender, instance, **kwargs):
+    '''Объекты, удалённые мимо remove(), в том числе каскадом. Корзина
+    учитывается до удаления: ингредиенты рецепта могут удаляться тем же
+    каскадом.'''
+    sender.objects.recipes_removed(instance.user_id, [instance.recipe_id])
+
+
+@receiver(post_save, sender=Recipe)
+def increase_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F('recipes_count') + 1)
+        transaction.on_commit(
+            lambda: TimelineEntry.objects.fan_out(instance))
+
+
+@receiver(post_delete, sender=Recipe)
+def decrease_recipes_count(sender, instance, **kwargs):
+    User.objects.filter(
+        pk=instance.author_id,
+        recipes_count__gt=0,
+    ).update(recipes_count=F('recipes_count') - 1)
+
+
+@receiver(post_save, sender=Recipe)
+def update_image_derivatives(sender, instance, **kwargs):
+    if derivatives_outdated(instance):
+        schedule_derivatives(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_image_derivatives(sender, instance, **kwargs):
+    delete_derivatives(instance)
+
+
+@receiver(post_save, sender=UserSubscribe)
+def subscribe_to_author(sender, instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.target_user_id).update(
+            subscribers_count=F('subscribers_count') + 1)
+        TimelineEntry.objects.backfill(
+            instance.target_user_id, [instance.subscriber_id])
+
+
+@receiver(post_delete, sender=UserSubscribe)
+def unsubscribe_from_author(sender, instance, **kwargs):
+    User.objects.filter(
+        pk=instance.target_user_id,
+        subscribers_count__gt=0,
+    ).update(subscribers_count=F('subscribers_count') - 1)
+    TimelineEntry.objects.prune(
+        instance.subscriber_id, instance.target_user_id)
+    if User.objects.filter(
+        pk=instance.target_user_id,
+        subscribers_count=settings.FEED_FANOUT_LIMIT - 1,
+    ).exists():
+        # Автор перестал быть популярным, и его рецепты больше не
+        # добавляются в ленты при чтении.
+        TimelineEntry.objects.backfill(
+            instance.target_user_id,
+            UserSubscribe.objects.filter(
+                target_user=instance.target_user_id,
+            ).values_list('subscriber_id', flat=True).iterator(),
+        )
+
+
+USER_PUBLIC_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+@receiver(pre_save, sender=Tag)
+def assign_tag_bit(sender, instance, **kwargs):
+    if instance.bit is None:
+        free_bits = Tag.objects.free_bits()
+        if not free_bits:
+            raise ValidationError(f'Тегов не может быть больше {TAG_BITS}')
+        instance.bit = free_bits[0]
+
+
+@receiver(pre_delete, sender=Tag)
+def clear_tag_bit(sender, instance, **kwargs):
+    '''Бит удалённого тега может достаться новому.'''
+    Recipe.objects.filter(tags=instance).update(
+        tags_mask=F('tags_mask').bitand(~(1 << instance.bit)))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_tag_recipes(sender, instance, **kwargs):
+    Recipe.objects.filter(tags=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def touch_ingredient_recipes(sender, instance, **kwargs):
+    Recipe.objects.filter(ingredients=instance).update(
+        updated_at=timezone.now())
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(sender, instance, created, update_fields, **kwargs):
+    '''Данные автора входят в представление рецепта.'''
+    if created or (update_fields is not None
+                   and not USER_PUBLIC_FIELDS & set(update_fields)):
+        return
+    Recipe.objects.filter(author=instance).update(updated_at=timezone.now())
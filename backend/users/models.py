@@ -4,7 +4,26 @@ from django.db import models
 from api.validators import validate_username
 
 
-class User(AbstractUser):
+class CounterFieldsMixin:
+    '''Денормализованные счётчики меняются только F()-обновлениями.
+
+    save() существующего объекта без update_fields их не записывает: копия
+    в памяти могла устареть, и запись затёрла бы изменения других
+    запросов.
+    '''
+    counter_fields = ()
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is None and not self._state.adding:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, update_fields=update_fields, **kwargs)
+
+
+class User(CounterFieldsMixin, AbstractUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
     username = models.CharField(
@@ -38,6 +57,18 @@ class User(AbstractUser):
         blank=False,
         null=False,
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Число рецептов',
+        default=0,
+        editable=False,
+    )
+    subscribers_count = models.PositiveIntegerField(
+        verbose_name='Число подписчиков',
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ('recipes_count', 'subscribers_count')
 
     class Meta:
         verbose_name = 'Пользователь'
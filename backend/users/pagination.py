@@ -1,6 +1,41 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class CustomPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPagination(CursorPagination):
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
+
+
+class SubscriptionCursorPagination(RecipeCursorPagination):
+    ordering = ('-subscription_id',)
+
+
+class FeedCursorPagination(RecipeCursorPagination):
+    '''Порядок ленты из RecipeQuerySet.feed: по индексу TimelineEntry.'''
+    ordering = ('-feed_pub_date', '-feed_recipe_id')
+
+
+class CursorPaginationMixin:
+    '''Курсорная пагинация по запросу ?paginate=cursor.
+
+    Без COUNT(*) и OFFSET: время ответа не зависит от глубины страницы.
+    cursor_pagination_classes сопоставляет действие вьюсета и класс
+    пагинации.
+    '''
+    cursor_pagination_classes = {}
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            pagination_class = self.cursor_pagination_classes.get(self.action)
+            if (pagination_class is None
+                    or self.request.query_params.get('paginate') != 'cursor'):
+                return super().paginator
+            self._paginator = pagination_class()
+        return self._paginator
@@ -1,10 +1,11 @@
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
 
+from foodgram_backend.metrics import TimedRepresentationMixin
 from users.models import User, UserSubscribe
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(TimedRepresentationMixin, UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -25,13 +26,16 @@ class CustomUserSerializer(UserSerializer):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return UserSubscribe.objects.filter(
             subscriber=user,
             target_user=obj.id
         ).exists()
 
 
-class CustomUserCreateSerializer(UserCreateSerializer):
+class CustomUserCreateSerializer(TimedRepresentationMixin,
+                                 UserCreateSerializer):
 
     class Meta:
         model = User
@@ -1,3 +1,5 @@
+from django.db.models import (Exists, F, OuterRef, Prefetch, Subquery,
+                              Value)
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
 from rest_framework.decorators import action
@@ -5,17 +7,60 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from api.permissions import CreateAnyOtherAuthenticatedPermission
-from api.serializers import SubscribeSerializer
+from api.serializers import RecipeSerializer, SubscribeSerializer
+from recipes.models import Recipe
 from users.models import User, UserSubscribe
-from users.pagination import CustomPagination
+from users.pagination import (CursorPaginationMixin, CustomPagination,
+                              FeedCursorPagination,
+                              SubscriptionCursorPagination)
 from users.serializers import CustomUserSerializer
 
 
-class CustomUserViewSet(UserViewSet):
+class CustomUserViewSet(CursorPaginationMixin, UserViewSet):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
     permission_classes = [CreateAnyOtherAuthenticatedPermission]
+    read_from_replica = True
     pagination_class = CustomPagination
+    cursor_pagination_classes = {
+        'subscriptions': SubscriptionCursorPagination,
+        'feed': FeedCursorPagination,
+    }
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if self.action in ('list', 'retrieve') and user.is_authenticated:
+            queryset = queryset.annotate(is_subscribed=Exists(
+                UserSubscribe.objects.filter(
+                    subscriber=user,
+                    target_user=OuterRef('pk'),
+                )
+            ))
+        return queryset
+
+    def get_recipes_limit(self):
+        try:
+            limit = int(self.request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return limit if limit > 0 else None
+
+    def get_recipes_prefetch(self):
+        '''Рецепты авторов страницы одним запросом, не больше recipes_limit
+        последних рецептов на автора.'''
+        recipes = Recipe.objects.only(
+            'id', 'name', 'image', 'image_thumbnail', 'image_webp',
+            'cooking_time', 'author'
+        ).order_by('-pub_date', '-id')
+        limit = self.get_recipes_limit()
+        if limit is not None:
+            recipes = recipes.filter(id__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).order_by('-pub_date', '-id').values('id')[:limit]
+            ))
+        return Prefetch('recipes', queryset=recipes)
 
     @action(
         detail=True,
@@ -46,13 +91,13 @@ class CustomUserViewSet(UserViewSet):
                 target_user=target_user
             )
             subscription.save()
+            target_user = User.objects.prefetch_related(
+                self.get_recipes_prefetch()
+            ).annotate(is_subscribed=Value(True)).get(pk=target_user.pk)
             serializer = SubscribeSerializer(
                 target_user,
-                data=request.data,
                 context={'request': request}
             )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
             return Response(serializer.data, status=201)
 
         if not subscribe_existence:
@@ -74,7 +119,14 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         subscriber = request.user
-        queryset = User.objects.filter(subscribers__subscriber=subscriber)
+        queryset = User.objects.filter(
+            subscribers__subscriber=subscriber
+        ).prefetch_related(
+            self.get_recipes_prefetch()
+        ).annotate(
+            is_subscribed=Value(True),
+            subscription_id=F('subscribers__id'),
+        )
         page = self.paginate_queryset(queryset)
         serializer = SubscribeSerializer(
             page,
@@ -82,3 +134,18 @@ class CustomUserViewSet(UserViewSet):
             context={'request': request}
         )
         return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=(IsAuthenticated,),
+    )
+    def feed(self, request):
+        queryset = Recipe.objects.for_user(request.user).feed(request.user)
+        page = self.paginate_queryset(queryset)
+        serializer = RecipeSerializer(
+            page,
+            many=True,
+            context={'request': request}
+        )
+        return self.get_paginated_response(serializer.data)